@@ -0,0 +1,83 @@
+'''Async-версии списков тегов и ингредиентов для запуска под ASGI
+
+DRF 3.12 не поддерживает async-представления, поэтому аутентификация,
+запросы к базе и сериализация выполняются в потоке через sync_to_async,
+а в цикле событий остаются ожидание и отдача готового ответа.
+'''
+from asgiref.sync import sync_to_async
+from django.http import HttpResponseNotAllowed, JsonResponse
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .catalog_cache import (async_catalog_response, ingredients_cache,
+                            tags_cache)
+from .views import IngredientsViewSet, TagViewSet
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+def make_view(viewset_class, request):
+    view = viewset_class(
+        request=Request(request), format_kwarg=None, action='list'
+    )
+    view.args, view.kwargs = (), {}
+
+    return view
+
+
+def json_response(data, status):
+    return JsonResponse(
+        data, status=status, json_dumps_params={'ensure_ascii': False}
+    )
+
+
+def authenticate(request):
+    '''Аутентификация DRF: ответ 401 при неверном ключе, иначе None'''
+    authenticators = [
+        authentication() for authentication
+        in api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    ]
+
+    try:
+        Request(request, authenticators=authenticators).user
+    except exceptions.AuthenticationFailed as error:
+        response = json_response({'detail': error.detail}, status=401)
+        header = authenticators[0].authenticate_header(request)
+        if header:
+            response['WWW-Authenticate'] = header
+
+        return response
+
+    return None
+
+
+async def tags_list(request):
+    if request.method not in SAFE_METHODS:
+        return HttpResponseNotAllowed(SAFE_METHODS)
+
+    error = await sync_to_async(authenticate)(request)
+    if error is not None:
+        return error
+
+    return await async_catalog_response(
+        request, tags_cache, 'list',
+        make_view(TagViewSet, request).get_list_data
+    )
+
+
+async def ingredients_list(request):
+    if request.method not in SAFE_METHODS:
+        return HttpResponseNotAllowed(SAFE_METHODS)
+
+    error = await sync_to_async(authenticate)(request)
+    if error is not None:
+        return error
+
+    name = request.GET.get('name', '')
+    view = make_view(IngredientsViewSet, request)
+
+    return await async_catalog_response(
+        request, ingredients_cache, f'list:{name}',
+        lambda: view.get_list_data(name)
+    )
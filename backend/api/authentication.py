@@ -1,3 +1,7 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
 from rest_framework.authentication import (TokenAuthentication,
                                            get_authorization_header)
 from rest_framework.authtoken.models import Token
@@ -6,6 +10,36 @@ from rest_framework.exceptions import AuthenticationFailed
 from foodgram_backend.constants import MAX_API_KEY_LENGHT
 
 
+def token_cache_key(key):
+    return 'auth-token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def get_cached_token(key):
+    if not settings.AUTH_TOKEN_CACHE_TTL:
+        return None
+
+    return caches[settings.AUTH_TOKEN_CACHE_ALIAS].get(token_cache_key(key))
+
+
+def cache_token(token):
+    '''Токен кэшируется вместе с пользователем из select_related'''
+    if not settings.AUTH_TOKEN_CACHE_TTL:
+        return
+
+    caches[settings.AUTH_TOKEN_CACHE_ALIAS].set(
+        token_cache_key(token.key), token, settings.AUTH_TOKEN_CACHE_TTL
+    )
+
+
+def invalidate_cached_tokens(*keys):
+    if not settings.AUTH_TOKEN_CACHE_TTL:
+        return
+
+    caches[settings.AUTH_TOKEN_CACHE_ALIAS].delete_many(
+        [token_cache_key(key) for key in keys]
+    )
+
+
 class APIKeyAuthentication(TokenAuthentication):
 
     def get_token_from_auth_header(self, auth):
@@ -43,12 +77,16 @@ class APIKeyAuthentication(TokenAuthentication):
             return self.authenticate_credentials(token)
 
     def authenticate_credentials(self, key):
+        key = key[MAX_API_KEY_LENGHT:]
+        token = get_cached_token(key)
 
-        try:
-            token = Token.objects.get(key=key[MAX_API_KEY_LENGHT:])
-        except Token.DoesNotExist:
-            raise AuthenticationFailed('Invalid API Key')
+        if token is None:
+
+            try:
+                token = Token.objects.select_related('user').get(key=key)
+            except Token.DoesNotExist:
+                raise AuthenticationFailed('Invalid API Key')
 
-        user = token.user
+            cache_token(token)
 
-        return (user, token)
+        return (token.user, token)
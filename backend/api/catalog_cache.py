@@ -0,0 +1,173 @@
+import hashlib
+import json
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from uuid import uuid4
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified
+from rest_framework.renderers import JSONRenderer
+
+from recipes.models import Tag
+
+
+class CatalogCache:
+    '''Версионированный кэш готовых JSON-ответов справочника
+
+    Версия всегда хранится в общем для процессов кэше CACHE_VERSION_ALIAS,
+    поэтому сброс из importcsv или из другого воркера виден всем сразу.
+    Значения лежат в LRU в памяти процесса и (необязательно) во втором
+    уровне - кэше Django, общем для всех воркеров.
+    '''
+
+    def __init__(self, name, maxsize, ttl, alias=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.alias = alias
+        self._lock = Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def shared(self):
+        return caches[self.alias] if self.alias else None
+
+    def _shared_key(self, *parts):
+        return ':'.join(('catalog', self.name) + parts)
+
+    def version(self):
+        return caches[settings.CACHE_VERSION_ALIAS].get_or_set(
+            self._shared_key('version'), lambda: uuid4().hex, timeout=None
+        )
+
+    def invalidate(self):
+        caches[settings.CACHE_VERSION_ALIAS].set(
+            self._shared_key('version'), uuid4().hex, timeout=None
+        )
+
+        with self._lock:
+            self._entries.clear()
+
+    def get(self, key):
+        '''Пара (тело ответа, ETag) или None'''
+        version = self.version()
+
+        with self._lock:
+            entry = self._entries.get((version, key))
+            if entry is not None and monotonic() - entry[2] < self.ttl:
+                self._entries.move_to_end((version, key))
+                self.hits += 1
+                return entry[:2]
+
+        if self.shared is not None:
+            entry = self.shared.get(self._shared_key(version, key))
+            if entry is not None:
+                self._store(version, key, *entry)
+                with self._lock:
+                    self.hits += 1
+                return entry
+
+        with self._lock:
+            self.misses += 1
+
+        return None
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+        }
+
+    def set(self, key, body):
+        version = self.version()
+        etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+        self._store(version, key, body, etag)
+
+        if self.shared is not None:
+            self.shared.set(
+                self._shared_key(version, key), (body, etag), self.ttl
+            )
+
+        return body, etag
+
+    def _store(self, version, key, body, etag):
+        with self._lock:
+            self._entries[(version, key)] = (body, etag, monotonic())
+            self._entries.move_to_end((version, key))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+def make_catalog_cache(name):
+    return CatalogCache(
+        name,
+        maxsize=settings.CATALOG_CACHE_MAXSIZE,
+        ttl=settings.CATALOG_CACHE_TTL,
+        alias=settings.CATALOG_CACHE_ALIAS
+    )
+
+
+tags_cache = make_catalog_cache('tags')
+ingredients_cache = make_catalog_cache('ingredients')
+
+
+def tag_ids_by_slug():
+    '''Словарь slug -> id из кэша тегов, сбрасывается вместе с ним'''
+    cached = tags_cache.get('slugs')
+
+    if cached is None:
+        cached = tags_cache.set('slugs', JSONRenderer().render(
+            dict(Tag.objects.values_list('slug', 'id'))
+        ))
+
+    return json.loads(cached[0])
+
+
+def catalog_response(request, catalog, key, get_data):
+    '''Ответ из кэша справочника с поддержкой If-None-Match'''
+    key = hashlib.md5(key.encode()).hexdigest()
+    cached = catalog.get(key)
+
+    if cached is None:
+        cached = catalog.set(key, JSONRenderer().render(get_data()))
+
+    return etag_response(request, *cached)
+
+
+async def async_catalog_response(request, catalog, key, get_data):
+    '''catalog_response для async-представлений
+
+    Чтение версии из общего кэша, запросы к базе и ко второму уровню
+    выполняются через sync_to_async.
+    '''
+    key = hashlib.md5(key.encode()).hexdigest()
+    cached = await sync_to_async(catalog.get)(key)
+
+    if cached is None:
+        body = JSONRenderer().render(await sync_to_async(get_data)())
+        cached = await sync_to_async(catalog.set)(key, body)
+
+    return etag_response(request, *cached)
+
+
+def etag_response(request, body, etag):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+
+    client_etags = {
+        tag.strip().removeprefix('W/') for tag in if_none_match.split(',')
+    }
+
+    if etag in client_etags or '*' in client_etags:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type='application/json')
+
+    response['ETag'] = etag
+
+    return response
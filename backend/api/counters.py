@@ -0,0 +1,58 @@
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from recipes.models import Favorite, Recipe, RecipeIngridient, ShoppingCart
+from users.models import CustomUser, Follow
+
+from .recipe_cache import COUNTER_ORDERINGS, invalidate_counter_orderings
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'shopping_cart_count', ShoppingCart, 'recipe'),
+    (Recipe, 'ingredients_count', RecipeIngridient, 'recipe'),
+    (CustomUser, 'recipes_count', Recipe, 'author'),
+    (CustomUser, 'followers_count', Follow, 'following'),
+)
+
+
+def change_counter(model, pk, field, delta):
+    '''Атомарное изменение счётчика без чтения строки'''
+    model.objects.filter(pk=pk).update(
+        **{field: Greatest(F(field) + delta, 0)}
+    )
+
+    if model is Recipe and field in COUNTER_ORDERINGS:
+        transaction.on_commit(invalidate_counter_orderings)
+
+
+def update_counters(instance, delta):
+    '''Изменение счётчиков, которые считают строки модели instance'''
+    for model, field, source, source_field in COUNTERS:
+        if isinstance(instance, source):
+            change_counter(
+                model, getattr(instance, f'{source_field}_id'), field, delta
+            )
+
+
+def count_subquery(model, field):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef('pk')}).order_by()
+            .values(field).annotate(total=Count('pk')).values('total')
+        ),
+        0
+    )
+
+
+def rebuild_counters():
+    '''Пересчёт всех счётчиков, по одному UPDATE на поле'''
+    updated = {
+        f'{model.__name__}.{field}': model.objects.update(
+            **{field: count_subquery(source, source_field)}
+        )
+        for model, field, source, source_field in COUNTERS
+    }
+    transaction.on_commit(invalidate_counter_orderings)
+
+    return updated
@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.cache import caches
+
+from recipes.models import Recipe
+from users.models import Follow
+
+
+def feed_cache_key(user_id):
+    return f'feed:{user_id}'
+
+
+def followed_recipes(user):
+    '''Рецепты авторов, на которых подписан пользователь
+
+    Подписки передаются подзапросом, а не списком id, поэтому размер
+    запроса не растёт с числом подписок.
+    '''
+    return Recipe.objects.filter(
+        author_id__in=Follow.objects.filter(user=user).values('following_id')
+    )
+
+
+def cached_feed_ids(user):
+    '''Id последних FEED_CACHE_SIZE рецептов ленты из кэша'''
+    cache = caches[settings.FEED_CACHE_ALIAS]
+    key = feed_cache_key(user.id)
+    ids = cache.get(key)
+
+    if ids is None:
+        ids = list(
+            followed_recipes(user).order_by('-pub_date', '-id')
+            .values_list('id', flat=True)[:settings.FEED_CACHE_SIZE]
+        )
+        cache.set(key, ids, settings.FEED_CACHE_TTL)
+
+    return ids
+
+
+def invalidate_feeds(user_ids):
+    if settings.FEED_CACHE_SIZE:
+        caches[settings.FEED_CACHE_ALIAS].delete_many(
+            [feed_cache_key(user_id) for user_id in user_ids]
+        )
+
+
+def invalidate_followers_feeds(author_id):
+    '''Ленты подписчиков перестраиваются при следующем чтении'''
+    if settings.FEED_CACHE_SIZE:
+        invalidate_feeds(
+            Follow.objects.filter(following_id=author_id)
+            .values_list('user_id', flat=True)
+        )
@@ -1,13 +1,32 @@
-from django.db.models import Exists, OuterRef
+from django.db.models import (BooleanField, Case, Count, Exists, OuterRef,
+                              Value, When)
 from django_filters import rest_framework as rf
+from rest_framework.filters import OrderingFilter
 
-from recipes.models import Favorite, Recipe, ShoppingCart, Ingridient, Tag
+from recipes.models import Ingridient, Recipe
+
+from .catalog_cache import tag_ids_by_slug
+from .recipe_search import search_recipes
+
+TAGS_MODES = (('any', 'Любой из тегов'), ('all', 'Все теги'))
+
+
+def tag_choices():
+    return [(slug, slug) for slug in tag_ids_by_slug()]
 
 
 class IngredientFilter(rf.FilterSet):
-    name = rf.CharFilter(
-        lookup_expr='icontains', field_name='name'
-    )
+    name = rf.CharFilter(method='filter_name')
+
+    def filter_name(self, queryset, name, value):
+        '''Совпадения по началу названия выводятся первыми'''
+        return queryset.filter(name__icontains=value).annotate(
+            is_prefix=Case(
+                When(name__istartswith=value, then=Value(True)),
+                default=Value(False),
+                output_field=BooleanField()
+            )
+        ).order_by('-is_prefix', 'name')
 
     class Meta:
         model = Ingridient
@@ -15,35 +34,95 @@ class IngredientFilter(rf.FilterSet):
 
 
 class RecipeFilter(rf.FilterSet):
-    is_favorited = rf.BooleanFilter(method='filter_is_in_favorite')
-    is_in_shopping_cart = rf.BooleanFilter(method='filter_is_in_shopping_cart')
+    is_favorited = rf.BooleanFilter(method='filter_user_flag')
+    is_in_shopping_cart = rf.BooleanFilter(method='filter_user_flag')
     author = rf.NumberFilter(field_name='author__id')
-    tags = rf.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all()
+    tags = rf.MultipleChoiceFilter(
+        method='filter_tags', choices=tag_choices
+    )
+    tags_mode = rf.ChoiceFilter(
+        method='filter_tags_mode', choices=TAGS_MODES, empty_label=None
     )
+    search = rf.CharFilter(method='filter_search')
 
-    def filter_is_in_shopping_cart(self, queryset, name, value):
-        if value:
-            return queryset.filter(
-                Exists(ShoppingCart.objects.filter(recipe=OuterRef('pk')))
-            )
-        else:
-            return queryset.exclude(
-                Exists(ShoppingCart.objects.filter(recipe=OuterRef('pk')))
-            )
+    USER_FLAG_LOOKUPS = {
+        'is_favorited': 'favorite__user',
+        'is_in_shopping_cart': 'shoppingcart__user',
+    }
 
-    def filter_is_in_favorite(self, queryset, name, value):
-        if value:
-            return queryset.filter(
-                Exists(Favorite.objects.filter(recipe=OuterRef('pk')))
-            )
-        else:
-            return queryset.exclude(
-                Exists(Favorite.objects.filter(recipe=OuterRef('pk')))
-            )
+    def filter_user_flag(self, queryset, name, value):
+        '''Рецепты из избранного или списка покупок текущего пользователя
+
+        Отбор идёт соединением по индексу (user, recipe), а флаг в ответе
+        после него известен заранее и не требует своего подзапроса.
+        '''
+        user = self.request.user
+
+        if not user.is_authenticated:
+            return queryset.none() if value else queryset
+
+        lookup = {self.USER_FLAG_LOOKUPS[name]: user}
+        queryset = (
+            queryset.filter(**lookup) if value else queryset.exclude(**lookup)
+        )
+
+        return queryset.annotate(
+            **{name: Value(value, output_field=BooleanField())}
+        )
+
+    def filter_tags(self, queryset, name, value):
+        '''Рецепты с любым (any) или со всеми (all) выбранными тегами
+
+        Отбор идёт подзапросом к таблице связей, поэтому строки рецептов
+        не дублируются и DISTINCT не нужен.
+        '''
+        slugs = tag_ids_by_slug()
+        tag_ids = {slugs[slug] for slug in value}
+        recipe_tags = Recipe.tags.through.objects.filter(tag_id__in=tag_ids)
+
+        if self.form.cleaned_data.get('tags_mode') == 'all':
+            return queryset.filter(id__in=(
+                recipe_tags.values('recipe_id')
+                .annotate(matched=Count('tag_id'))
+                .filter(matched=len(tag_ids))
+                .values('recipe_id')
+            ))
+
+        return queryset.filter(
+            Exists(recipe_tags.filter(recipe_id=OuterRef('pk')))
+        )
+
+    def filter_tags_mode(self, queryset, name, value):
+        return queryset
+
+    def filter_search(self, queryset, name, value):
+        '''Полнотекстовый поиск по названию, ингредиентам и описанию'''
+        return search_recipes(queryset, value)
 
     class Meta:
         model = Recipe
-        fields = ('is_favorited', 'is_in_shopping_cart', 'author', 'tags')
+        fields = (
+            'is_favorited', 'is_in_shopping_cart', 'author', 'tags',
+            'tags_mode', 'search'
+        )
+
+
+class RecipeOrderingFilter(OrderingFilter):
+    '''Сортировка по параметру ordering с id для одинаковых значений
+
+    Результаты поиска без явного ordering сортируются по рангу.
+    '''
+
+    def get_ordering(self, request, queryset, view):
+        if (
+            'search_rank' in queryset.query.annotations
+            and self.ordering_param not in request.query_params
+        ):
+            return ['-search_rank', '-id']
+
+        ordering = list(super().get_ordering(request, queryset, view) or [])
+
+        if not {'id', '-id', 'pk', '-pk'} & set(ordering):
+            ordering.append('-id')
+
+        return ordering
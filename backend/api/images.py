@@ -0,0 +1,209 @@
+import base64
+import binascii
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import filetype
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import (InMemoryUploadedFile,
+                                            TemporaryUploadedFile)
+from django.db import close_old_connections, connections, transaction
+from drf_extra_fields.fields import Base64FieldMixin, Base64ImageField
+from PIL import Image
+
+from foodgram_backend.constants import (IMAGE_DECODE_CHUNK_SIZE,
+                                        IMAGE_RENDITIONS)
+from recipes.models import Recipe
+
+from .recipe_cache import invalidate_recipes
+
+logger = logging.getLogger(__name__)
+
+RENDITION_EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg'}
+
+_executor = None
+
+
+def rendition_name(name, rendition):
+    '''Путь к уменьшенной копии картинки рядом с оригиналом'''
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    extension = RENDITION_EXTENSIONS[settings.IMAGE_RENDITION_FORMAT]
+
+    return os.path.join(directory, rendition, f'{stem}.{extension}')
+
+
+def make_renditions(name):
+    '''Сохраняет все размеры из IMAGE_RENDITIONS в выбранном формате'''
+    image_format = settings.IMAGE_RENDITION_FORMAT
+
+    with default_storage.open(name) as source:
+        image = Image.open(source)
+        image.load()
+
+    if image_format == 'JPEG' or image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGB' if image_format == 'JPEG' else 'RGBA')
+
+    for rendition, size in IMAGE_RENDITIONS.items():
+        resized = image.copy()
+        resized.thumbnail(size, Image.LANCZOS)
+
+        buffer = BytesIO()
+        resized.save(
+            buffer, image_format, quality=settings.IMAGE_RENDITION_QUALITY
+        )
+
+        path = rendition_name(name, rendition)
+        if default_storage.exists(path):
+            default_storage.delete(path)
+        default_storage.save(path, ContentFile(buffer.getvalue()))
+
+    recipes = Recipe.objects.filter(image=name)
+    recipes.update(image_renditions=True)
+    invalidate_recipes(*recipes.values_list('id', flat=True))
+
+
+def delete_renditions(name):
+    '''Удаляет копии заменённой или удалённой картинки'''
+    for rendition in IMAGE_RENDITIONS:
+        path = rendition_name(name, rendition)
+        if default_storage.exists(path):
+            default_storage.delete(path)
+
+
+def _run_logged(job, name):
+    try:
+        job(name)
+    except Exception:
+        logger.exception('Не удалось обработать копии картинки %s', name)
+
+
+def _run_in_worker(job, name):
+    '''Задача в потоке пула
+
+    Сигналы начала и конца запроса в пуле не приходят, поэтому
+    соединения с базой проверяются перед задачей и закрываются после,
+    иначе поток держал бы соединение, разорванное базой или pgbouncer.
+    '''
+    close_old_connections()
+    try:
+        _run_logged(job, name)
+    finally:
+        connections.close_all()
+
+
+def get_executor():
+    global _executor
+
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_RENDITION_WORKERS,
+            thread_name_prefix='image-renditions'
+        )
+
+    return _executor
+
+
+def schedule(job, name):
+    '''Задача запускается после коммита в пуле потоков, а не в запросе'''
+    if not name:
+        return
+
+    if settings.IMAGE_RENDITION_WORKERS:
+        transaction.on_commit(
+            lambda: get_executor().submit(_run_in_worker, job, name)
+        )
+    else:
+        transaction.on_commit(lambda: _run_logged(job, name))
+
+
+def schedule_renditions(name):
+    schedule(make_renditions, name)
+
+
+def schedule_renditions_cleanup(name):
+    schedule(delete_renditions, name)
+
+
+def rendition_url(image, rendition, request=None):
+    '''URL копии нужного размера или оригинала, пока копии не готовы
+
+    Готовность копий отмечает make_renditions в Recipe.image_renditions,
+    поэтому хранилище при сериализации не опрашивается.
+    '''
+    if not image:
+        return ''
+
+    if getattr(image.instance, 'image_renditions', False):
+        url = default_storage.url(rendition_name(image.name, rendition))
+    else:
+        url = image.url
+
+    if request is not None:
+        return request.build_absolute_uri(url)
+
+    return url
+
+
+class RecipeImageField(Base64ImageField):
+    '''Base64-картинка, декодируемая частями с ограничением размера
+
+    В ответе отдаётся копия размера context['image_rendition'].
+    '''
+
+    def to_internal_value(self, base64_data):
+        if not isinstance(base64_data, str) or not base64_data:
+            return super().to_internal_value(base64_data)
+
+        header, _, payload = base64_data.rpartition(';base64,')
+        content_type = header.replace('data:', '') or None
+        # Переносы строк внутри base64 сдвинули бы границы частей
+        payload = ''.join(payload.split())
+
+        size = len(payload) * 3 // 4 - payload[-2:].count('=')
+        if size > settings.MAX_IMAGE_UPLOAD_SIZE:
+            raise ValidationError(
+                'Размер изображения не должен превышать '
+                f'{settings.MAX_IMAGE_UPLOAD_SIZE} байт'
+            )
+
+        name = str(uuid.uuid4())
+        if size > settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+            upload = TemporaryUploadedFile(name, content_type, size, None)
+        else:
+            upload = InMemoryUploadedFile(
+                BytesIO(), None, name, content_type, size, None
+            )
+
+        try:
+            for start in range(0, len(payload), IMAGE_DECODE_CHUNK_SIZE):
+                upload.write(base64.b64decode(
+                    payload[start:start + IMAGE_DECODE_CHUNK_SIZE]
+                ))
+        except (TypeError, binascii.Error, ValueError):
+            upload.close()
+            raise ValidationError(self.INVALID_FILE_MESSAGE)
+
+        upload.seek(0)
+        extension = filetype.guess_extension(upload.read(8192))
+        if extension not in self.ALLOWED_TYPES:
+            upload.close()
+            raise ValidationError(self.INVALID_TYPE_MESSAGE)
+
+        upload.name = f'{name}.{extension}'
+        upload.seek(0)
+
+        return super(Base64FieldMixin, self).to_internal_value(upload)
+
+    def to_representation(self, file):
+        return rendition_url(
+            file,
+            self.context.get('image_rendition', 'detail'),
+            self.context.get('request')
+        )
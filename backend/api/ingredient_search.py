@@ -0,0 +1,79 @@
+from bisect import bisect_left
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+
+from recipes.models import Ingridient
+
+from .catalog_cache import ingredients_cache
+
+
+class IngredientSearchIndex:
+    '''Префиксный индекс ингредиентов в памяти процесса
+
+    Справочник ингредиентов небольшой (около 2200 строк из importcsv),
+    поэтому он целиком хранится отсортированным по названию: префиксные
+    совпадения находятся бинарным поиском, вхождения - проходом по списку.
+    '''
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = Lock()
+        self._keys = None
+        self._entries = None
+        self._version = None
+        self._built_at = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._keys = None
+            self._entries = None
+
+    def _build(self, version):
+        entries = sorted(
+            Ingridient.objects.values('id', 'name', 'measurement_unit'),
+            key=lambda entry: (entry['name'].lower(), entry['id'])
+        )
+        self._keys = [entry['name'].lower() for entry in entries]
+        self._entries = entries
+        self._version = version
+        self._built_at = monotonic()
+
+    def _get(self):
+        version = ingredients_cache.version()
+
+        with self._lock:
+            if (
+                self._entries is None
+                or self._version != version
+                or monotonic() - self._built_at > self.ttl
+            ):
+                self._build(version)
+
+            return self._keys, self._entries
+
+    def search(self, query, limit):
+        '''Сначала совпадения по префиксу, затем по вхождению'''
+        query = query.lower()
+        keys, entries = self._get()
+
+        start = bisect_left(keys, query)
+        end = start
+        while end < len(keys) and keys[end].startswith(query):
+            end += 1
+
+        result = entries[start:min(end, start + limit)]
+
+        for index, key in enumerate(keys):
+            if len(result) >= limit:
+                break
+            if query in key and not start <= index < end:
+                result.append(entries[index])
+
+        return result
+
+
+ingredient_search_index = IngredientSearchIndex(
+    settings.INGREDIENT_SEARCH_INDEX_TTL
+)
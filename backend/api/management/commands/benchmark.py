@@ -0,0 +1,552 @@
+import json
+import random
+import shutil
+import tempfile
+import tracemalloc
+from itertools import count
+from time import perf_counter
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_test_environment,
+                               teardown_test_environment)
+from rest_framework.authtoken.models import Token
+
+from api.counters import rebuild_counters
+from api.recipe_search import refresh_search_vectors
+from api.recommendations import (build_neighbors, build_recommendations,
+                                 save_neighbors, save_recommendations,
+                                 user_interactions)
+from recipes.models import (Favorite, Ingridient, Recipe, RecipeIngridient,
+                            ShoppingCart, Tag)
+from users.models import CustomUser, Follow
+
+PASSWORD = 'benchmark-password'
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=='
+)
+DEFAULT_BASELINE = settings.BASE_DIR / 'benchmark_baseline.json'
+METRICS = ('queries', 'p50_ms', 'p95_ms', 'alloc_kib')
+# Сценарии *_token_cache повторяют соседние с прогретым кэшем токенов
+TOKEN_CACHE = {'AUTH_TOKEN_CACHE_TTL': 300}
+
+
+class Scenario:
+    '''Один маршрут API: запрос, пользователь и подготовка состояния'''
+
+    def __init__(self, name, method, path, user=None, data=None,
+                 status=200, before=None, overrides=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.user = user
+        self.data = data
+        self.status = status
+        self.before = before
+        self.overrides = overrides or {}
+
+    def request(self, client, state):
+        path = self.path(state) if callable(self.path) else self.path
+        data = self.data(state) if callable(self.data) else self.data
+        kwargs = {}
+
+        if data is not None:
+            kwargs = {
+                'data': json.dumps(data), 'content_type': 'application/json'
+            }
+
+        return getattr(client, self.method)(path, **kwargs)
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, round(percent / 100 * (len(values) - 1)))
+    return values[index]
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный прогон всех маршрутов API на синтетических данных. '
+        'Данные создаются во временной тестовой базе текущего DATABASES '
+        '(SQLite или PostgreSQL), рабочая база не затрагивается.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--recipes', type=int, default=500)
+        parser.add_argument('--ingredients', type=int, default=300)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--tags', type=int, default=5)
+        parser.add_argument(
+            '--follows', type=int, default=10,
+            help='Подписок на одного пользователя'
+        )
+        parser.add_argument(
+            '--favorites', type=int, default=20,
+            help='Избранных рецептов на одного пользователя'
+        )
+        parser.add_argument(
+            '--carts', type=int, default=5,
+            help='Рецептов в списке покупок на одного пользователя'
+        )
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--only', nargs='*', default=None,
+            help='Запустить только перечисленные сценарии'
+        )
+        parser.add_argument('--baseline', default=str(DEFAULT_BASELINE))
+        parser.add_argument(
+            '--update-baseline', action='store_true',
+            help='Записать результаты прогона в файл baseline'
+        )
+        parser.add_argument(
+            '--baseline-metrics', default=','.join(METRICS),
+            help='Метрики, записываемые в baseline через запятую'
+        )
+        parser.add_argument(
+            '--tolerance', type=float, default=0.5,
+            help='Допустимый рост времени и памяти относительно baseline'
+        )
+        parser.add_argument(
+            '--conn-max-age', type=int, default=None,
+            help='0 - новое соединение с базой на каждый запрос, как без '
+                 'постоянных соединений; по умолчанию CONN_MAX_AGE из '
+                 'настроек'
+        )
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        conn_max_age = options['conn_max_age']
+        if conn_max_age is None:
+            conn_max_age = connection.settings_dict['CONN_MAX_AGE']
+        self.reconnect = conn_max_age == 0
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        media_root = tempfile.mkdtemp()
+
+        try:
+            with override_settings(MEDIA_ROOT=media_root):
+                dataset = self.seed(options)
+                results = self.run(self.scenarios(dataset), options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        self.report(results)
+
+        if options['update_baseline']:
+            self.write_baseline(results, options)
+            return
+
+        self.compare(results, options)
+
+    def seed(self, options):
+        rand = random.Random(options['seed'])
+        started = perf_counter()
+        password = make_password(PASSWORD)
+
+        CustomUser.objects.bulk_create(
+            CustomUser(
+                username=f'bench{index}', email=f'bench{index}@example.com',
+                first_name='Bench', last_name=str(index), password=password
+            ) for index in range(max(options['users'], 3))
+        )
+        users = list(CustomUser.objects.order_by('id'))
+
+        Tag.objects.bulk_create(
+            Tag(name=f'Тег {index}', color='#E26C2D', slug=f'tag{index}')
+            for index in range(max(options['tags'], 1))
+        )
+        tags = list(Tag.objects.order_by('id'))
+
+        Ingridient.objects.bulk_create(
+            Ingridient(name=f'ингредиент {index}', measurement_unit='г')
+            for index in range(max(
+                options['ingredients'], options['ingredients_per_recipe']
+            ))
+        )
+        ingredients = list(Ingridient.objects.values_list('id', flat=True))
+
+        Recipe.objects.bulk_create(
+            Recipe(
+                author=users[index % len(users)], name=f'Recipe {index}',
+                image='recipes/images/benchmark.png',
+                description='Benchmark recipe', cooking_time=10 + index % 50
+            ) for index in range(max(options['recipes'], 2))
+        )
+        recipes = list(Recipe.objects.values_list('id', flat=True))
+
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe_id=recipe_id, tag_id=tag.id)
+            for recipe_id in recipes
+            for tag in rand.sample(tags, min(2, len(tags)))
+        )
+        RecipeIngridient.objects.bulk_create(
+            RecipeIngridient(
+                recipe_id=recipe_id, ingredient_id=ingredient_id,
+                amount=rand.randint(1, 500)
+            )
+            for recipe_id in recipes
+            for ingredient_id in rand.sample(
+                ingredients, options['ingredients_per_recipe']
+            )
+        )
+
+        for model, per_user, field, targets in (
+            (Follow, options['follows'], 'following', users),
+            (Favorite, options['favorites'], 'recipe_id', recipes),
+            (ShoppingCart, options['carts'], 'recipe_id', recipes),
+        ):
+            model.objects.bulk_create(
+                model(**{'user': user, field: target})
+                for user in users
+                for target in rand.sample(
+                    [target for target in targets if target != user],
+                    min(per_user, len(targets) - 1)
+                )
+            )
+
+        rebuild_counters()
+        refresh_search_vectors(Recipe.objects.all())
+        interactions = user_interactions()
+        neighbors = build_neighbors(interactions, min_support=1)
+        save_neighbors(neighbors)
+        save_recommendations(build_recommendations(interactions, neighbors))
+
+        if self.verbosity > 0:
+            self.stdout.write(
+                f'Данные созданы за {perf_counter() - started:.1f} с: '
+                f'{len(users)} пользователей, {len(recipes)} рецептов'
+            )
+
+        return {'users': users, 'tags': tags, 'ingredients': ingredients}
+
+    def scenarios(self, dataset):
+        user, login_user, password_user = dataset['users'][:3]
+        tags = dataset['tags']
+        ingredients = dataset['ingredients']
+        own_recipe = Recipe.objects.filter(author=user).first().id
+        other_recipe = Recipe.objects.exclude(author=user).first().id
+        other_user = dataset['users'][-1]
+        new_users = count()
+
+        recipe_data = {
+            'name': 'Benchmark recipe', 'text': 'Benchmark',
+            'cooking_time': 15, 'image': IMAGE,
+            'tags': [tag.id for tag in tags[:2]],
+            'ingredients': [
+                {'id': ingredient_id, 'amount': 10}
+                for ingredient_id in ingredients[:10]
+            ],
+        }
+
+        def create_recipe(state):
+            return Recipe.objects.create(
+                author=user, name='To delete', description='Benchmark',
+                image='recipes/images/benchmark.png', cooking_time=5
+            ).id
+
+        def new_user_data(index):
+            return {
+                'email': f'new{index}@example.com', 'username': f'new{index}',
+                'first_name': 'New', 'last_name': 'User',
+                'password': PASSWORD
+            }
+
+        def reset_password(state):
+            password_user.set_password(PASSWORD)
+            password_user.save(update_fields=['password'])
+
+        def toggle(model, lookup, exists):
+            def before(state):
+                if exists:
+                    model.objects.get_or_create(**lookup)
+                else:
+                    model.objects.filter(**lookup).delete()
+            return before
+
+        favorite = {'user': user, 'recipe_id': other_recipe}
+        cart = {'user': user, 'recipe_id': other_recipe}
+        follow = {'user': user, 'following': other_user}
+        slugs = '&'.join(f'tags={tag.slug}' for tag in tags[:2])
+        pantry = '&'.join(
+            f'ingredients={ingredient_id}'
+            for ingredient_id in ingredients[:20]
+        )
+
+        return [
+            Scenario('recipes_list_anon', 'get', '/api/recipes/'),
+            Scenario('recipes_list', 'get', '/api/recipes/', user),
+            Scenario(
+                'recipes_list_token_cache', 'get', '/api/recipes/', user,
+                overrides=TOKEN_CACHE
+            ),
+            Scenario(
+                'recipes_list_limit_25', 'get', '/api/recipes/?limit=25', user
+            ),
+            Scenario(
+                'recipes_list_page_5', 'get', '/api/recipes/?page=5', user
+            ),
+            Scenario(
+                'recipes_favorited', 'get',
+                '/api/recipes/?is_favorited=1', user
+            ),
+            Scenario(
+                'recipes_in_cart', 'get',
+                '/api/recipes/?is_in_shopping_cart=1', user
+            ),
+            Scenario('recipes_tags', 'get', f'/api/recipes/?{slugs}', user),
+            Scenario(
+                'recipes_search', 'get',
+                '/api/recipes/?search=recipe%20ингредиент', user
+            ),
+            Scenario(
+                'recipes_author', 'get',
+                f'/api/recipes/?author={other_user.id}', user
+            ),
+            Scenario(
+                'recipe_detail', 'get', f'/api/recipes/{other_recipe}/', user
+            ),
+            Scenario('recipes_feed', 'get', '/api/recipes/feed/', user),
+            Scenario(
+                'recipes_can_cook', 'get',
+                f'/api/recipes/can_cook/?{pantry}&min_coverage=0.2', user
+            ),
+            Scenario(
+                'recipe_similar', 'get',
+                f'/api/recipes/{other_recipe}/similar/', user
+            ),
+            Scenario(
+                'recipes_recommended', 'get', '/api/recipes/recommended/', user
+            ),
+            Scenario(
+                'recipe_create', 'post', '/api/recipes/', user,
+                data=recipe_data, status=201
+            ),
+            Scenario(
+                'recipe_update', 'patch', f'/api/recipes/{own_recipe}/',
+                user, data=recipe_data
+            ),
+            Scenario(
+                'recipe_delete', 'delete',
+                lambda recipe_id: f'/api/recipes/{recipe_id}/', user,
+                status=204, before=create_recipe
+            ),
+            Scenario(
+                'favorite_create', 'post',
+                f'/api/recipes/{other_recipe}/favorite/', user, status=201,
+                before=toggle(Favorite, favorite, exists=False)
+            ),
+            Scenario(
+                'favorite_delete', 'delete',
+                f'/api/recipes/{other_recipe}/favorite/', user, status=204,
+                before=toggle(Favorite, favorite, exists=True)
+            ),
+            Scenario(
+                'shopping_cart_create', 'post',
+                f'/api/recipes/{other_recipe}/shopping_cart/', user,
+                status=201, before=toggle(ShoppingCart, cart, exists=False)
+            ),
+            Scenario(
+                'shopping_cart_delete', 'delete',
+                f'/api/recipes/{other_recipe}/shopping_cart/', user,
+                status=204, before=toggle(ShoppingCart, cart, exists=True)
+            ),
+            Scenario(
+                'download_shopping_cart', 'get',
+                '/api/recipes/download_shopping_cart/', user
+            ),
+            Scenario('tags_list', 'get', '/api/tags/', user),
+            Scenario('tag_detail', 'get', f'/api/tags/{tags[0].id}/', user),
+            Scenario('ingredients_list', 'get', '/api/ingredients/', user),
+            Scenario(
+                'ingredients_search', 'get',
+                '/api/ingredients/?name=ингр', user
+            ),
+            Scenario(
+                'ingredient_detail', 'get',
+                f'/api/ingredients/{ingredients[0]}/', user
+            ),
+            Scenario('users_list', 'get', '/api/users/', user),
+            Scenario('users_me', 'get', '/api/users/me/', user),
+            Scenario(
+                'users_me_token_cache', 'get', '/api/users/me/', user,
+                overrides=TOKEN_CACHE
+            ),
+            Scenario(
+                'user_detail', 'get', f'/api/users/{other_user.id}/', user
+            ),
+            Scenario(
+                'user_create', 'post', '/api/users/', status=201,
+                data=lambda state: new_user_data(next(new_users))
+            ),
+            Scenario(
+                'subscriptions', 'get',
+                '/api/users/subscriptions/?recipes_limit=3', user
+            ),
+            Scenario(
+                'subscribe', 'post',
+                f'/api/users/{other_user.id}/subscribe/?recipes_limit=3',
+                user, status=201, before=toggle(Follow, follow, exists=False)
+            ),
+            Scenario(
+                'unsubscribe', 'delete',
+                f'/api/users/{other_user.id}/subscribe/', user, status=204,
+                before=toggle(Follow, follow, exists=True)
+            ),
+            Scenario(
+                'set_password', 'post', '/api/users/set_password/',
+                password_user, status=204, before=reset_password,
+                data={
+                    'current_password': PASSWORD,
+                    'new_password': PASSWORD + '-new'
+                }
+            ),
+            Scenario(
+                'token_login', 'post', '/api/token/login/', data={
+                    'email': login_user.email, 'password': PASSWORD
+                }
+            ),
+            Scenario(
+                'token_logout', 'post', '/api/token/logout/', login_user,
+                status=204
+            ),
+        ]
+
+    def client_for(self, user):
+        client = Client()
+
+        if user is not None:
+            token, _ = Token.objects.get_or_create(user=user)
+            client.defaults['HTTP_AUTHORIZATION'] = f'Token {token.key}'
+
+        return client
+
+    def measure(self, scenario):
+        '''Число запросов, время в секундах и пик выделенной памяти'''
+        state = scenario.before(None) if scenario.before else None
+        client = self.client_for(scenario.user)
+
+        if self.reconnect:
+            connection.close()
+
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        allocated_before = tracemalloc.get_traced_memory()[0]
+
+        with override_settings(**scenario.overrides), \
+                CaptureQueriesContext(connection) as queries:
+            started = perf_counter()
+            response = scenario.request(client, state)
+            if getattr(response, 'streaming', False):
+                b''.join(response.streaming_content)
+            elapsed = perf_counter() - started
+
+        allocated = tracemalloc.get_traced_memory()[1] - allocated_before
+
+        if response.status_code != scenario.status:
+            raise CommandError(
+                f'{scenario.name}: ожидался статус {scenario.status}, '
+                f'получен {response.status_code}'
+            )
+
+        return len(queries), elapsed, allocated
+
+    def run(self, scenarios, options):
+        results = {}
+
+        for scenario in scenarios:
+            if options['only'] and scenario.name not in options['only']:
+                continue
+
+            self.measure(scenario)
+            queries = []
+            timings = []
+
+            for _ in range(options['iterations']):
+                queries_count, elapsed, _ = self.measure(scenario)
+                queries.append(queries_count)
+                timings.append(elapsed * 1000)
+
+            tracemalloc.start()
+            try:
+                _, _, allocated = self.measure(scenario)
+            finally:
+                tracemalloc.stop()
+
+            results[scenario.name] = {
+                'queries': max(queries),
+                'p50_ms': round(percentile(timings, 50), 2),
+                'p95_ms': round(percentile(timings, 95), 2),
+                'alloc_kib': round(allocated / 1024, 1),
+            }
+
+        return results
+
+    def report(self, results):
+        self.stdout.write('{:<26}{:>9}{:>10}{:>10}{:>12}'.format(
+            'scenario', *METRICS
+        ))
+
+        for name, metrics in results.items():
+            self.stdout.write('{:<26}{:>9}{:>10}{:>10}{:>12}'.format(
+                name, *(metrics[metric] for metric in METRICS)
+            ))
+
+    def write_baseline(self, results, options):
+        metrics = options['baseline_metrics'].split(',')
+        baseline = {
+            name: {metric: values[metric] for metric in metrics}
+            for name, values in results.items()
+        }
+
+        with open(options['baseline'], 'w', encoding='utf-8') as file:
+            json.dump(baseline, file, indent=4, sort_keys=True)
+            file.write('\n')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Baseline записан в {options["baseline"]}'
+        ))
+
+    def compare(self, results, options):
+        try:
+            with open(options['baseline'], encoding='utf-8') as file:
+                baseline = json.load(file)
+        except FileNotFoundError:
+            self.stdout.write(self.style.WARNING(
+                f'Файл {options["baseline"]} не найден, сравнение пропущено'
+            ))
+            return
+
+        regressions = []
+
+        for name, metrics in results.items():
+            expected = baseline.get(name, {})
+
+            for metric, value in metrics.items():
+                if metric not in expected:
+                    continue
+
+                limit = expected[metric]
+                if metric != 'queries':
+                    limit = limit * (1 + options['tolerance'])
+
+                if value > limit:
+                    regressions.append(
+                        f'{name}.{metric}: {value} > {expected[metric]}'
+                    )
+
+        if regressions:
+            raise CommandError(
+                'Регрессия относительно baseline:\n' + '\n'.join(regressions)
+            )
+
+        self.stdout.write(self.style.SUCCESS('Регрессий не найдено'))
@@ -0,0 +1,88 @@
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from .benchmark import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        'HTTP-нагрузка на запущенный сервер: запросы в секунду и p50/p95 '
+        'для нескольких уровней конкурентности. Нужен для сравнения '
+        'режимов SERVER_MODE=wsgi и SERVER_MODE=asgi.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'url', help='Например http://localhost:7000/api/tags/'
+        )
+        parser.add_argument(
+            '--concurrency', type=int, nargs='+', default=[1, 8, 32],
+            help='Число одновременных клиентов'
+        )
+        parser.add_argument(
+            '--requests', type=int, default=500,
+            help='Запросов на каждый уровень конкурентности'
+        )
+        parser.add_argument(
+            '--token', default=None,
+            help='Токен для заголовка Authorization'
+        )
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme != 'http':
+            raise CommandError('Поддерживается только http://')
+
+        path = url.path + (f'?{url.query}' if url.query else '')
+        headers = {}
+        if options['token']:
+            headers['Authorization'] = f'Token {options["token"]}'
+
+        self.stdout.write('{:>12}{:>10}{:>10}{:>10}{:>8}'.format(
+            'concurrency', 'rps', 'p50_ms', 'p95_ms', 'errors'
+        ))
+
+        for concurrency in options['concurrency']:
+            per_client = max(options['requests'] // concurrency, 1)
+
+            def client(_):
+                connection = http.client.HTTPConnection(
+                    url.hostname, url.port or 80
+                )
+                timings = []
+                errors = 0
+
+                for _ in range(per_client):
+                    started = perf_counter()
+                    try:
+                        connection.request('GET', path, headers=headers)
+                        response = connection.getresponse()
+                        response.read()
+                        errors += response.status >= 400
+                    except (OSError, http.client.HTTPException):
+                        errors += 1
+                        connection.close()
+                    timings.append((perf_counter() - started) * 1000)
+
+                connection.close()
+                return timings, errors
+
+            started = perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                results = list(executor.map(client, range(concurrency)))
+            elapsed = perf_counter() - started
+
+            timings = [value for result in results for value in result[0]]
+            errors = sum(result[1] for result in results)
+
+            self.stdout.write('{:>12}{:>10}{:>10}{:>10}{:>8}'.format(
+                concurrency,
+                round(len(timings) / elapsed, 1),
+                round(percentile(timings, 50), 2),
+                round(percentile(timings, 95), 2),
+                errors
+            ))
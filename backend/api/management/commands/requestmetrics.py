@@ -0,0 +1,64 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from foodgram_backend.metrics import (HISTOGRAMS, collect,
+                                      estimate_percentile, prometheus_text)
+
+COLUMNS = (
+    'route', 'count', 'p50_ms', 'p95_ms', 'queries', 'db_ms', 'ser_ms',
+    'size_kib'
+)
+
+
+def average(histogram, scale=1):
+    if not histogram['count']:
+        return 0
+
+    return round(histogram['sum'] / histogram['count'] / scale, 1)
+
+
+class Command(BaseCommand):
+    help = (
+        'Сводка гистограмм RequestMetricsMiddleware по маршрутам, '
+        'собранных воркерами в METRICS_DIR.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--prometheus', action='store_true',
+            help='Вывести метрики в текстовом формате Prometheus'
+        )
+
+    def handle(self, *args, **options):
+        if not settings.METRICS_DIR:
+            raise CommandError(
+                'Задайте METRICS_DIR, чтобы воркеры сохраняли метрики'
+            )
+
+        routes = collect()
+
+        if options['prometheus']:
+            self.stdout.write(prometheus_text(routes), ending='')
+            return
+
+        width = max([len(key) for key in routes] + [len(COLUMNS[0])])
+        row = '{:<%d}' % width + '{:>10}' * (len(COLUMNS) - 1)
+        self.stdout.write(row.format(*COLUMNS))
+
+        for key in sorted(routes):
+            histograms = routes[key]
+            duration = histograms['duration_ms']
+            self.stdout.write(row.format(
+                key,
+                duration['count'],
+                estimate_percentile(
+                    duration, HISTOGRAMS['duration_ms'], 50
+                ),
+                estimate_percentile(
+                    duration, HISTOGRAMS['duration_ms'], 95
+                ),
+                average(histograms['queries']),
+                average(histograms['db_ms']),
+                average(histograms['serializer_ms']),
+                average(histograms['size_bytes'], 1024),
+            ))
@@ -1,13 +1,194 @@
-from rest_framework.pagination import PageNumberPagination
+import hashlib
+from functools import partial
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.paginator import Paginator
+from django.db import connection
+from django.utils.functional import cached_property
+from rest_framework.pagination import (BasePagination, CursorPagination,
+                                       PageNumberPagination)
 
 from foodgram_backend.constants import MAX_PAGE_SIZE_LENGHT
 
+from .querysets import without_user_flags
+
+
+def count_signature(path, params):
+    return hashlib.md5(repr((path, params)).encode()).hexdigest()
+
+
+def count_version_key(model):
+    return f'count-version:{model._meta.label_lower}'
+
+
+def invalidate_counts(model):
+    '''Сброс всех закэшированных COUNT для модели'''
+    caches[settings.COUNT_CACHE_ALIAS].set(
+        count_version_key(model), uuid4().hex, timeout=None
+    )
+
+
+def estimate_count(model):
+    '''Оценка числа строк таблицы по статистике планировщика PostgreSQL'''
+    if connection.vendor != 'postgresql':
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+            [model._meta.db_table]
+        )
+        row = cursor.fetchone()
+
+    return row[0] if row else None
+
+
+class CachedCountPaginator(Paginator):
+    '''Paginator, который берёт COUNT из кэша или из статистики'''
+
+    def __init__(self, object_list, per_page, signature=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.signature = signature
+
+    def count_objects(self):
+        return without_user_flags(self.object_list).count()
+
+    @cached_property
+    def count(self):
+        if self.signature is None:
+            return self.count_objects()
+
+        model = self.object_list.model
+        cache = caches[settings.COUNT_CACHE_ALIAS]
+        version = cache.get_or_set(
+            count_version_key(model), lambda: uuid4().hex, timeout=None
+        )
+        key = f'count:{model._meta.label_lower}:{version}:{self.signature}'
+
+        count = cache.get(key)
+        if count is not None:
+            return count
+
+        count = None
+        if not self.object_list.query.where:
+            estimate = estimate_count(model)
+            if estimate and estimate >= settings.APPROXIMATE_COUNT_THRESHOLD:
+                count = estimate
+
+        if count is None:
+            count = self.count_objects()
+
+        cache.set(key, count, settings.COUNT_CACHE_TTL)
+
+        return count
+
+
+class CachedCountPagination(PageNumberPagination):
+    '''COUNT кэшируется по маршруту и параметрам, влияющим на выборку
+
+    В подпись входят только поля filterset_class представления и его
+    count_params, остальные параметры запроса число объектов не
+    меняют. Параметры из uncached_params зависят от пользователя, с ними
+    число объектов всегда считается точно.
+    '''
+    page_size_query_param = 'limit'
+    max_page_size = MAX_PAGE_SIZE_LENGHT
+    uncached_params = set()
+
+    def get_count_signature(self, request, view=None):
+        consumed = set(getattr(view, 'count_params', ()))
+        filterset_class = getattr(view, 'filterset_class', None)
+        if filterset_class is not None:
+            consumed |= set(filterset_class.base_filters)
+
+        params = sorted(
+            (key, sorted(request.query_params.getlist(key)))
+            for key in request.query_params
+            if key in consumed
+        )
+
+        if any(key in self.uncached_params for key, _ in params):
+            return None
+
+        return count_signature(request.path, params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.django_paginator_class = partial(
+            CachedCountPaginator,
+            signature=self.get_count_signature(request, view)
+        )
+
+        return super().paginate_queryset(queryset, request, view)
+
 
 class UserPagination(PageNumberPagination):
     page_size_query_param = 'limit'
     max_page_size = MAX_PAGE_SIZE_LENGHT
 
 
-class RecipePagination(PageNumberPagination):
+class UserListPagination(CachedCountPagination):
+    pass
+
+
+class RecipePagination(CachedCountPagination):
+    uncached_params = {'is_favorited', 'is_in_shopping_cart'}
+
+
+class RecipeCursorPagination(CursorPagination):
+    '''Keyset-пагинация без COUNT и OFFSET'''
     page_size_query_param = 'limit'
     max_page_size = MAX_PAGE_SIZE_LENGHT
+    ordering = ('-pub_date', '-id')
+
+    def get_ordering(self, request, queryset, view):
+        return self.ordering
+
+
+class SubscriptionsCursorPagination(RecipeCursorPagination):
+    ordering = ('following_id',)
+
+
+class OptionalCursorPagination(BasePagination):
+    '''Постраничная пагинация по умолчанию, курсорная по запросу
+
+    Курсорный режим включается параметром pagination=cursor, ссылки
+    next и previous в нём передают параметр cursor.
+    '''
+    page_number_class = None
+    cursor_class = None
+
+    def is_cursor_request(self, request):
+        return (
+            'cursor' in request.query_params
+            or request.query_params.get('pagination') == 'cursor'
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.is_cursor_request(request):
+            self.paginator = self.cursor_class()
+        else:
+            self.paginator = self.page_number_class()
+
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    @property
+    def display_page_controls(self):
+        return self.paginator.display_page_controls
+
+    def to_html(self):
+        return self.paginator.to_html()
+
+
+class RecipeFeedPagination(OptionalCursorPagination):
+    page_number_class = RecipePagination
+    cursor_class = RecipeCursorPagination
+
+
+class SubscriptionsPagination(OptionalCursorPagination):
+    page_number_class = UserPagination
+    cursor_class = SubscriptionsCursorPagination
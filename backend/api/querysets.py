@@ -0,0 +1,119 @@
+from django.db.models import (Count, Exists, FloatField, OuterRef, Prefetch,
+                              Q, prefetch_related_objects)
+from django.db.models.functions import Cast, Greatest
+
+from recipes.models import Favorite, Recipe, RecipeIngridient, ShoppingCart
+from users.models import Follow
+
+
+def recipe_prefetches():
+    '''Связи, которые RecipeSerializer выводит без дополнительных запросов'''
+    return (
+        'tags',
+        Prefetch(
+            'recipeingridient_set',
+            queryset=RecipeIngridient.objects.select_related('ingredient')
+        ),
+    )
+
+
+# Флаги пользователя нужны только в ответе, на число строк не влияют
+USER_FLAGS = (
+    'is_favorited', 'is_in_shopping_cart', 'author_is_subscribed',
+    'is_subscribed',
+)
+
+
+def without_user_flags(queryset):
+    '''queryset для COUNT без подзапросов флагов пользователя
+
+    С любой аннотацией Django 3.2 считает COUNT(*) по подзапросу со
+    всеми аннотациями, и Exists вычислялись бы для каждой строки.
+    '''
+    queryset = queryset.all()
+    for name in USER_FLAGS:
+        queryset.query.annotations.pop(name, None)
+
+    if queryset.query.annotation_select_mask is not None:
+        queryset.query.set_annotation_mask(
+            set(queryset.query.annotation_select_mask) - set(USER_FLAGS)
+        )
+
+    return queryset
+
+
+def annotate_recipe_flags(queryset, user):
+    '''Флаги is_favorited, is_in_shopping_cart и подписки на автора'''
+    if not user.is_authenticated:
+        return queryset
+
+    return queryset.annotate(
+        is_favorited=Exists(
+            Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+        ),
+        is_in_shopping_cart=Exists(
+            ShoppingCart.objects.filter(user=user, recipe=OuterRef('pk'))
+        ),
+        author_is_subscribed=Exists(
+            Follow.objects.filter(user=user, following=OuterRef('author'))
+        ),
+    )
+
+
+def annotate_is_subscribed(queryset, user):
+    '''Флаг is_subscribed для queryset пользователей'''
+    if not user.is_authenticated:
+        return queryset
+
+    return queryset.annotate(
+        is_subscribed=Exists(
+            Follow.objects.filter(user=user, following=OuterRef('pk'))
+        )
+    )
+
+
+def prefetch_subscription_recipes(follows, recipes_limit):
+    '''Последние recipes_limit рецептов каждого автора из подписок
+
+    Для каждого автора страницы строится отдельный подзапрос с LIMIT,
+    поэтому объём выборки не зависит от числа рецептов у авторов.
+    '''
+    recipes = Recipe.objects.defer('search_vector').order_by('-pub_date')
+
+    if recipes_limit > 0:
+        latest_recipes = Q()
+        for follow in follows:
+            latest_recipes |= Q(id__in=Recipe.objects.filter(
+                author_id=follow.following_id
+            ).order_by('-pub_date').values('id')[:recipes_limit])
+        recipes = recipes.filter(latest_recipes)
+
+    prefetch_related_objects(
+        follows,
+        Prefetch(
+            'following__recipe',
+            queryset=recipes,
+            to_attr='subscription_recipes'
+        )
+    )
+
+
+def cookable_recipes(ingredient_ids, min_coverage):
+    '''Рецепты по доле ингредиентов, которые есть у пользователя
+
+    Совпадения считаются одной группировкой по строкам RecipeIngridient
+    с нужными ингредиентами (индекс ingredient, recipe), общее число
+    ингредиентов берётся из счётчика Recipe.ingredients_count.
+    '''
+    return Recipe.objects.filter(
+        recipeingridient__ingredient_id__in=ingredient_ids
+    ).annotate(
+        matched_ingredients=Count('recipeingridient')
+    ).annotate(
+        coverage=Cast('matched_ingredients', FloatField()) / Greatest(
+            Cast('ingredients_count', FloatField()),
+            Cast('matched_ingredients', FloatField())
+        )
+    ).filter(
+        coverage__gte=min_coverage
+    ).order_by('-coverage', '-matched_ingredients', '-id')
@@ -0,0 +1,171 @@
+import hashlib
+import json
+from contextlib import contextmanager
+from uuid import uuid4
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from recipes.models import Favorite, ShoppingCart
+from users.models import Follow
+
+from .catalog_cache import CatalogCache
+
+USER_DEPENDENT_PARAMS = {'is_favorited', 'is_in_shopping_cart'}
+# Счётчики меняются через F() без сигналов, поэтому у страниц,
+# отсортированных по ним, своя версия
+COUNTER_ORDERINGS = {'favorites_count', 'shopping_cart_count'}
+COUNTERS_VERSION_KEY = 'catalog:recipes:counters:version'
+RECIPE_VERSION_KEY = 'catalog:recipe-details:recipe:{}:version'
+
+# Страницы списка сбрасываются любым изменением, которое может их
+# затронуть, детали рецепта - только изменением этого рецепта. Общая
+# версия деталей меняется, лишь когда связи с тегом удаляются скопом.
+recipes_cache = CatalogCache(
+    'recipes',
+    maxsize=settings.RECIPE_CACHE_MAXSIZE,
+    ttl=settings.RECIPE_CACHE_TTL,
+    alias=settings.CATALOG_CACHE_ALIAS
+)
+recipe_details_cache = CatalogCache(
+    'recipe-details',
+    maxsize=settings.RECIPE_CACHE_MAXSIZE,
+    ttl=settings.RECIPE_CACHE_TTL,
+    alias=settings.CATALOG_CACHE_ALIAS
+)
+
+
+def counters_version():
+    return caches[settings.CACHE_VERSION_ALIAS].get_or_set(
+        COUNTERS_VERSION_KEY, lambda: uuid4().hex, timeout=None
+    )
+
+
+def invalidate_counter_orderings():
+    caches[settings.CACHE_VERSION_ALIAS].set(
+        COUNTERS_VERSION_KEY, uuid4().hex, timeout=None
+    )
+
+
+def recipe_version(pk):
+    return caches[settings.CACHE_VERSION_ALIAS].get_or_set(
+        RECIPE_VERSION_KEY.format(pk), lambda: uuid4().hex, timeout=None
+    )
+
+
+def invalidate_recipes(*recipe_ids):
+    '''Сброс деталей перечисленных рецептов и страниц списка'''
+    caches[settings.CACHE_VERSION_ALIAS].set_many(
+        {RECIPE_VERSION_KEY.format(pk): uuid4().hex for pk in recipe_ids},
+        timeout=None
+    )
+    recipes_cache.invalidate()
+
+
+def invalidate_all_recipes():
+    recipe_details_cache.invalidate()
+    recipes_cache.invalidate()
+
+
+def recipe_cache_key(request, action, pk=None):
+    '''Ключ по хосту, действию и отсортированным параметрам запроса
+
+    В ключ деталей входит версия рецепта, в ключ списка, отсортированного
+    по счётчику, - версия счётчиков.
+    '''
+    params = sorted(
+        (key, sorted(request.query_params.getlist(key)))
+        for key in request.query_params
+    )
+    ordering = ','.join(request.query_params.getlist('ordering'))
+    version = None
+    if pk is not None and str(pk).isdigit():
+        version = recipe_version(pk)
+    elif any(field in ordering for field in COUNTER_ORDERINGS):
+        version = counters_version()
+    key = repr(
+        (request.build_absolute_uri('/'), action, pk, params, version)
+    )
+
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+def is_cacheable(request):
+    return (
+        settings.RECIPE_CACHE_TTL > 0
+        and request.accepted_renderer.format == 'json'
+        and not USER_DEPENDENT_PARAMS & set(request.query_params)
+    )
+
+
+@contextmanager
+def anonymous_request(request):
+    '''Ответ строится так, как его увидел бы анонимный пользователь'''
+    user = request.user
+    request.user = AnonymousUser()
+
+    try:
+        yield
+    finally:
+        request.user = user
+
+
+def overlay_user_flags(data, user):
+    '''Проставляет флаги пользователя в ответ, собранный для анонима'''
+    recipes = data['results'] if 'results' in data else [data]
+    recipe_ids = [recipe['id'] for recipe in recipes]
+    author_ids = {recipe['author']['id'] for recipe in recipes}
+
+    favorited = set(Favorite.objects.filter(
+        user=user, recipe_id__in=recipe_ids
+    ).values_list('recipe_id', flat=True))
+    in_shopping_cart = set(ShoppingCart.objects.filter(
+        user=user, recipe_id__in=recipe_ids
+    ).values_list('recipe_id', flat=True))
+    subscribed = set(Follow.objects.filter(
+        user=user, following_id__in=author_ids
+    ).values_list('following_id', flat=True))
+
+    for recipe in recipes:
+        recipe['is_favorited'] = recipe['id'] in favorited
+        recipe['is_in_shopping_cart'] = recipe['id'] in in_shopping_cart
+        recipe['author']['is_subscribed'] = (
+            recipe['author']['id'] in subscribed
+        )
+
+    return data
+
+
+def cached_recipe_response(request, cache, key, get_response):
+    '''Общий для всех ответ из кэша, флаги пользователя поверх него'''
+    cached = cache.get(key)
+    cache_status = 'HIT'
+
+    if cached is None:
+        cache_status = 'MISS'
+
+        with anonymous_request(request):
+            response = get_response()
+
+        if response.status_code != 200:
+            return response
+
+        cached = cache.set(key, JSONRenderer().render(response.data))
+
+    body, etag = cached
+
+    if request.user.is_authenticated:
+        response = Response(
+            overlay_user_flags(json.loads(body), request.user)
+        )
+    else:
+        response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+
+    response['X-Cache'] = cache_status
+
+    return response
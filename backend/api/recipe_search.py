@@ -0,0 +1,151 @@
+import re
+from bisect import bisect_left
+from collections import defaultdict
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connection
+from django.db.models import (Case, F, FloatField, OuterRef, Subquery, Value,
+                              When)
+
+from recipes.models import Recipe, RecipeIngridient
+
+from .recipe_cache import recipes_cache
+
+WORD = re.compile(r'\w+')
+# Веса частей рецепта совпадают с весами A, B, C в SearchRank
+WEIGHTS = {'name': 1.0, 'ingredients': 0.4, 'description': 0.2}
+
+
+def uses_postgres():
+    return connection.vendor == 'postgresql'
+
+
+def search_document():
+    '''tsvector рецепта: название (A), ингредиенты (B), описание (C)'''
+    config = settings.RECIPE_SEARCH_CONFIG
+    ingredients = Subquery(
+        RecipeIngridient.objects.filter(recipe=OuterRef('pk')).order_by()
+        .values('recipe').annotate(names=StringAgg('ingredient__name', ' '))
+        .values('names')
+    )
+
+    return (
+        SearchVector('name', weight='A', config=config)
+        + SearchVector(ingredients, weight='B', config=config)
+        + SearchVector('description', weight='C', config=config)
+    )
+
+
+def refresh_search_vectors(recipes):
+    '''Пересчёт поискового вектора одним UPDATE, только для PostgreSQL'''
+    if not uses_postgres():
+        return 0
+
+    return recipes.update(search_vector=search_document())
+
+
+class RecipeSearchIndex:
+    '''Словарный индекс рецептов в памяти процесса
+
+    Замена полнотекстового поиска для баз без tsvector (SQLite в
+    тестовых прогонах). Слова запроса ищутся по префиксу бинарным
+    поиском, индекс перестраивается вместе со сбросом кэша рецептов.
+    '''
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = Lock()
+        self._words = None
+        self._postings = None
+        self._version = None
+        self._built_at = 0
+
+    def _build(self, version):
+        postings = defaultdict(lambda: defaultdict(float))
+
+        def add(recipe_id, text, weight):
+            for word in WORD.findall(text.lower()):
+                postings[word][recipe_id] += weight
+
+        for recipe_id, name, description in Recipe.objects.values_list(
+            'id', 'name', 'description'
+        ):
+            add(recipe_id, name, WEIGHTS['name'])
+            add(recipe_id, description, WEIGHTS['description'])
+
+        for recipe_id, name in RecipeIngridient.objects.values_list(
+            'recipe_id', 'ingredient__name'
+        ):
+            add(recipe_id, name, WEIGHTS['ingredients'])
+
+        self._words = sorted(postings)
+        self._postings = postings
+        self._version = version
+        self._built_at = monotonic()
+
+    def _get(self):
+        version = recipes_cache.version()
+
+        with self._lock:
+            if (
+                self._postings is None
+                or self._version != version
+                or monotonic() - self._built_at > self.ttl
+            ):
+                self._build(version)
+
+            return self._words, self._postings
+
+    def search(self, query):
+        '''Вес каждого рецепта, в котором есть все слова запроса'''
+        words, postings = self._get()
+        ranks = None
+
+        for term in set(WORD.findall(query.lower())):
+            scores = defaultdict(float)
+            index = bisect_left(words, term)
+
+            while index < len(words) and words[index].startswith(term):
+                for recipe_id, weight in postings[words[index]].items():
+                    scores[recipe_id] = max(scores[recipe_id], weight)
+                index += 1
+
+            ranks = scores if ranks is None else {
+                recipe_id: rank + scores[recipe_id]
+                for recipe_id, rank in ranks.items() if recipe_id in scores
+            }
+            if not ranks:
+                return {}
+
+        return ranks or {}
+
+
+recipe_search_index = RecipeSearchIndex(settings.RECIPE_SEARCH_INDEX_TTL)
+
+
+def search_recipes(queryset, query):
+    '''Рецепты, подходящие под запрос, с рангом в search_rank'''
+    if uses_postgres():
+        search_query = SearchQuery(
+            query, config=settings.RECIPE_SEARCH_CONFIG,
+            search_type='websearch'
+        )
+        return queryset.filter(search_vector=search_query).annotate(
+            search_rank=SearchRank(F('search_vector'), search_query)
+        )
+
+    ranks = recipe_search_index.search(query)
+
+    return queryset.filter(id__in=ranks).annotate(search_rank=Case(
+        *[
+            When(id=recipe_id, then=Value(rank))
+            for recipe_id, rank in ranks.items()
+        ],
+        default=Value(0.0),
+        output_field=FloatField()
+    ))
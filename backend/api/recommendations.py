@@ -0,0 +1,219 @@
+'''Похожие и рекомендованные рецепты
+
+Матрица совместной встречаемости рецептов в избранном и списках покупок
+строится офлайн командой buildrecommendations и хранится в разреженном
+виде (словарь пар), для каждого рецепта в RecipeNeighbor сохраняются
+ближайшие соседи по косинусной мере, для каждого пользователя в
+RecipeRecommendation - рецепты с наибольшей суммой сходства. При чтении
+и те и другие берутся по индексу без агрегации.
+
+Пары пересчитываются полностью при каждом запуске, инкрементальна
+только запись: перезаписываются списки, которые изменились.
+'''
+import heapq
+from collections import defaultdict
+from math import sqrt
+
+from django.db import transaction
+
+from foodgram_backend.constants import (IMPORT_BATCH_SIZE,
+                                        RECOMMENDATION_MAX_USER_ITEMS,
+                                        RECOMMENDATION_MIN_SUPPORT,
+                                        RECOMMENDATION_NEIGHBORS)
+from recipes.models import (Favorite, Recipe, RecipeNeighbor,
+                            RecipeRecommendation, ShoppingCart)
+from users.models import CustomUser
+
+# Рецепт в избранном значит для сходства больше, чем в списке покупок
+WEIGHTS = ((Favorite, 1.0), (ShoppingCart, 0.5))
+SCORE_DIGITS = 4
+
+
+def user_interactions():
+    '''Вес и id строки каждого рецепта для каждого пользователя
+
+    Отметок времени у избранного и списков покупок нет, порядок
+    добавления определяется по id строки.
+    '''
+    interactions = defaultdict(dict)
+
+    for model, weight in WEIGHTS:
+        for user_id, recipe_id, row_id in model.objects.values_list(
+            'user_id', 'recipe_id', 'id'
+        ).iterator():
+            items = interactions[user_id]
+            items[recipe_id] = max(
+                items.get(recipe_id, (0, 0)), (weight, row_id)
+            )
+
+    return interactions
+
+
+def recent_items(items, max_user_items):
+    '''Не больше max_user_items рецептов пользователя: [(id, вес), ...]
+
+    Сначала избранное, затем список покупок, внутри каждого - последние
+    добавленные.
+    '''
+    recent = sorted(items.items(), key=lambda item: item[1])[-max_user_items:]
+
+    return [(recipe_id, weight) for recipe_id, (weight, _) in recent]
+
+
+def build_neighbors(interactions, neighbors=RECOMMENDATION_NEIGHBORS,
+                    min_support=RECOMMENDATION_MIN_SUPPORT,
+                    max_user_items=RECOMMENDATION_MAX_USER_ITEMS):
+    '''Соседи каждого рецепта: {recipe_id: [(neighbor_id, score), ...]}
+
+    Пары хранятся один раз (меньший id первым), у пользователей с
+    очень большим избранным учитываются только max_user_items рецептов
+    из recent_items, чтобы число пар не росло квадратично. Пары, которые
+    встретились меньше чем у min_support пользователей, отбрасываются
+    как шум.
+    '''
+    pairs = defaultdict(lambda: [0.0, 0])
+    norms = defaultdict(float)
+
+    for items in interactions.values():
+        items = sorted(recent_items(items, max_user_items))
+
+        for index, (recipe_id, weight) in enumerate(items):
+            norms[recipe_id] += weight * weight
+            for other_id, other_weight in items[index + 1:]:
+                pair = pairs[recipe_id, other_id]
+                pair[0] += weight * other_weight
+                pair[1] += 1
+
+    heaps = defaultdict(list)
+
+    for (recipe_id, other_id), (product, support) in pairs.items():
+        if support < min_support:
+            continue
+
+        score = round(
+            product / sqrt(norms[recipe_id] * norms[other_id]), SCORE_DIGITS
+        )
+        for key, neighbor_id in ((recipe_id, other_id), (other_id, recipe_id)):
+            heap = heaps[key]
+            if len(heap) < neighbors:
+                heapq.heappush(heap, (score, -neighbor_id))
+            else:
+                heapq.heappushpop(heap, (score, -neighbor_id))
+
+    return {
+        recipe_id: [
+            (-neighbor_id, score)
+            for score, neighbor_id in sorted(heap, reverse=True)
+        ]
+        for recipe_id, heap in heaps.items()
+    }
+
+
+def build_recommendations(interactions, neighbors,
+                          limit=RECOMMENDATION_NEIGHBORS,
+                          max_user_items=RECOMMENDATION_MAX_USER_ITEMS):
+    '''Рекомендации каждому пользователю: {user_id: [(recipe_id, score)]}
+
+    Соседи его рецептов по сумме сходства, уже добавленные рецепты
+    пропускаются.
+    '''
+    recommendations = {}
+
+    for user_id, items in interactions.items():
+        scores = defaultdict(float)
+
+        for recipe_id, _ in recent_items(items, max_user_items):
+            for neighbor_id, score in neighbors.get(recipe_id, ()):
+                if neighbor_id not in items:
+                    scores[neighbor_id] += score
+
+        best = heapq.nlargest(
+            limit, scores.items(), key=lambda item: (item[1], -item[0])
+        )
+        if best:
+            recommendations[user_id] = [
+                (recipe_id, round(score, SCORE_DIGITS))
+                for recipe_id, score in best
+            ]
+
+    return recommendations
+
+
+def save_lists(model, owner_field, item_field, lists, owners, items):
+    '''Перезапись только тех списков, которые изменились'''
+    current = defaultdict(list)
+
+    for owner_id, item_id, score in model.objects.order_by(
+        owner_field, '-score', item_field
+    ).values_list(owner_field, item_field, 'score').iterator():
+        current[owner_id].append((item_id, score))
+
+    changed = [
+        owner_id for owner_id in current.keys() | lists.keys()
+        if current.get(owner_id) != lists.get(owner_id)
+    ]
+
+    with transaction.atomic():
+        for start in range(0, len(changed), IMPORT_BATCH_SIZE):
+            model.objects.filter(**{
+                f'{owner_field}__in': changed[start:start + IMPORT_BATCH_SIZE]
+            }).delete()
+
+        model.objects.bulk_create(
+            (
+                model(**{
+                    owner_field: owner_id, item_field: item_id,
+                    'score': score
+                })
+                for owner_id in changed if owner_id in owners
+                for item_id, score in lists.get(owner_id, ())
+                if item_id in items
+            ),
+            batch_size=IMPORT_BATCH_SIZE
+        )
+
+    return len(changed)
+
+
+def save_neighbors(neighbors):
+    recipes = set(Recipe.objects.values_list('id', flat=True))
+
+    return save_lists(
+        RecipeNeighbor, 'recipe_id', 'neighbor_id', neighbors,
+        recipes, recipes
+    )
+
+
+def save_recommendations(recommendations):
+    return save_lists(
+        RecipeRecommendation, 'user_id', 'recipe_id', recommendations,
+        set(CustomUser.objects.values_list('id', flat=True)),
+        set(Recipe.objects.values_list('id', flat=True))
+    )
+
+
+def similar_recipes(recipe_id):
+    return Recipe.objects.filter(
+        neighbor_of__recipe_id=recipe_id
+    ).order_by('-neighbor_of__score', 'id')
+
+
+def recommended_recipe_ids(user, limit):
+    '''Готовые рекомендации по индексу (user, -score)
+
+    Рецепты, добавленные в избранное или покупки после пересчёта,
+    пропускаются.
+    '''
+    return list(
+        RecipeRecommendation.objects.filter(user=user).exclude(
+            recipe_id__in=Favorite.objects.filter(
+                user=user
+            ).values('recipe_id')
+        ).exclude(
+            recipe_id__in=ShoppingCart.objects.filter(
+                user=user
+            ).values('recipe_id')
+        ).order_by('-score', 'recipe_id').values_list(
+            'recipe_id', flat=True
+        )[:limit]
+    )
@@ -1,17 +1,25 @@
 from colorfield.fields import ColorField
 from django.contrib.auth.models import AnonymousUser
+from django.db import transaction
+from django.db.models import prefetch_related_objects
 from djoser.serializers import UserSerializer, UserCreateSerializer
-from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 
-from foodgram_backend.constants import MAX_USER_FIELDS_LENGHT
+from foodgram_backend.constants import (DEFAULT_MIN_COVERAGE,
+                                        MAX_PANTRY_INGREDIENTS,
+                                        MAX_USER_FIELDS_LENGHT)
+from foodgram_backend.middleware import TimedRepresentationMixin
 from recipes.models import (Favorite, Ingridient, Recipe, RecipeIngridient,
                             ShoppingCart, Tag)
 from users.models import CustomUser, Follow
+from .counters import change_counter
+from .images import (RecipeImageField, rendition_url, schedule_renditions,
+                     schedule_renditions_cleanup)
+from .querysets import recipe_prefetches
 from .validators import validate_username, validate_recipe_name
 
 
-class UserSerializer(UserSerializer):
+class UserSerializer(TimedRepresentationMixin, UserSerializer):
     is_subscribed = serializers.SerializerMethodField(
         required=False
     )
@@ -29,6 +37,10 @@ class UserSerializer(UserSerializer):
         if isinstance(request.user, AnonymousUser):
             return False
 
+        is_subscribed = getattr(obj, 'is_subscribed', None)
+        if is_subscribed is not None:
+            return is_subscribed
+
         return Follow.objects.filter(
             user=request.user, following__id=obj.id
         ).exists()
@@ -73,16 +85,12 @@ class RecipesInSubscriptionsSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'image', 'cooking_time']
 
     def get_image(self, obj):
-        request = self.context.get('request')
-        image_url = obj.image.url if obj.image else ''
-
-        if request is not None:
-            return request.build_absolute_uri(image_url)
-
-        return image_url
+        return rendition_url(
+            obj.image, 'thumbnail', self.context.get('request')
+        )
 
 
-class FollowSerializer(serializers.ModelSerializer):
+class FollowSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
     id = serializers.IntegerField(
         source='following.id', read_only=True
     )
@@ -102,10 +110,10 @@ class FollowSerializer(serializers.ModelSerializer):
         read_only=True
     )
     recipes = RecipesInSubscriptionsSerializer(
-        many=True, read_only=True, source='following.recipe',
+        many=True, read_only=True, source='following.subscription_recipes',
     )
-    recipes_count = serializers.SerializerMethodField(
-        read_only=True
+    recipes_count = serializers.IntegerField(
+        source='following.recipes_count', read_only=True
     )
 
     class Meta:
@@ -115,14 +123,11 @@ class FollowSerializer(serializers.ModelSerializer):
             'is_subscribed', 'recipes', 'recipes_count'
         ]
 
-    def get_recipes_count(self, obj):
-        return len(Recipe.objects.filter(author=obj.following))
-
     def get_is_subscribed(self, obj):
         return True
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
     color = ColorField()
 
     class Meta:
@@ -130,23 +135,23 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'color', 'slug')
 
 
-class IngridientSerializer(serializers.ModelSerializer):
+class IngridientSerializer(TimedRepresentationMixin,
+                           serializers.ModelSerializer):
 
     class Meta:
         model = Ingridient
         fields = ['id', 'name', 'measurement_unit']
 
 
-class FavoriteSerializer(serializers.ModelSerializer):
+class FavoriteSerializer(TimedRepresentationMixin,
+                         serializers.ModelSerializer):
     id = serializers.IntegerField(
         source='recipe.id', read_only=True
     )
     name = serializers.CharField(
         source='recipe.name', read_only=True
     )
-    image = serializers.CharField(
-        source='recipe.image', read_only=True
-    )
+    image = serializers.SerializerMethodField(read_only=True)
     cooking_time = serializers.IntegerField(
         source='recipe.cooking_time', read_only=True
     )
@@ -155,17 +160,21 @@ class FavoriteSerializer(serializers.ModelSerializer):
         model = Favorite
         fields = ['id', 'name', 'image', 'cooking_time']
 
+    def get_image(self, obj):
+        return rendition_url(
+            obj.recipe.image, 'thumbnail', self.context.get('request')
+        )
+
 
-class ShoppingCartSerializer(serializers.ModelSerializer):
+class ShoppingCartSerializer(TimedRepresentationMixin,
+                             serializers.ModelSerializer):
     id = serializers.IntegerField(
         source='recipe.id', read_only=True
     )
     name = serializers.CharField(
         source='recipe.name', read_only=True
     )
-    image = serializers.CharField(
-        source='recipe.image', read_only=True
-    )
+    image = serializers.SerializerMethodField(read_only=True)
     cooking_time = serializers.IntegerField(
         source='recipe.cooking_time', read_only=True
     )
@@ -174,9 +183,14 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
         model = ShoppingCart
         fields = ['id', 'name', 'image', 'cooking_time']
 
+    def get_image(self, obj):
+        return rendition_url(
+            obj.recipe.image, 'thumbnail', self.context.get('request')
+        )
+
 
 class RecipeIngridientSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingridient.objects.all())
+    id = serializers.IntegerField()
     amount = serializers.FloatField()
 
     class Meta:
@@ -184,13 +198,29 @@ class RecipeIngridientSerializer(serializers.ModelSerializer):
         fields = ['id', 'amount']
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeIngridientReadSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(
+        source='ingredient.id', read_only=True
+    )
+    name = serializers.CharField(
+        source='ingredient.name', read_only=True
+    )
+    measurement_unit = serializers.CharField(
+        source='ingredient.measurement_unit', read_only=True
+    )
+
+    class Meta:
+        model = RecipeIngridient
+        fields = ['id', 'name', 'measurement_unit', 'amount']
+
+
+class RecipeSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
     text = serializers.CharField(source='description')
     tags = serializers.PrimaryKeyRelatedField(
         many=True, queryset=Tag.objects.all()
     )
-    ingredients = RecipeIngridientSerializer(many=True)
-    image = Base64ImageField()
+    ingredients = RecipeIngridientSerializer(many=True, write_only=True)
+    image = RecipeImageField()
     author = UserSerializer(read_only=True)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
@@ -231,6 +261,11 @@ class RecipeSerializer(serializers.ModelSerializer):
         if len(value) == 0:
             raise serializers.ValidationError
 
+        if len(set(value)) != len(value):
+            raise serializers.ValidationError(
+                'Нельзя использовать один и тот же тег дважды'
+            )
+
         return value
 
     def validate_ingredients(self, value):
@@ -242,6 +277,20 @@ class RecipeSerializer(serializers.ModelSerializer):
         if len(value) == 0 or amount < 1:
             raise serializers.ValidationError
 
+        ingredients_ids = [item['id'] for item in value]
+        if len(set(ingredients_ids)) != len(ingredients_ids):
+            raise serializers.ValidationError(
+                'Нельзя использовать один и тот же ингредиент дважды'
+            )
+
+        ingredients = Ingridient.objects.in_bulk(ingredients_ids)
+        for item in value:
+            if item['id'] not in ingredients:
+                raise serializers.ValidationError(
+                    f'Ингредиента с id {item["id"]} не существует'
+                )
+            item['id'] = ingredients[item['id']]
+
         return value
 
     def get_is_favorited(self, instance):
@@ -250,6 +299,10 @@ class RecipeSerializer(serializers.ModelSerializer):
         if isinstance(request.user, AnonymousUser):
             return False
 
+        is_favorited = getattr(instance, 'is_favorited', None)
+        if is_favorited is not None:
+            return is_favorited
+
         return Favorite.objects.filter(
             recipe=instance.id, user=request.user
         ).exists()
@@ -260,128 +313,138 @@ class RecipeSerializer(serializers.ModelSerializer):
         if isinstance(request.user, AnonymousUser):
             return False
 
+        is_in_shopping_cart = getattr(instance, 'is_in_shopping_cart', None)
+        if is_in_shopping_cart is not None:
+            return is_in_shopping_cart
+
         return ShoppingCart.objects.filter(
             recipe=instance.id, user=request.user
         ).exists()
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients_data = validated_data.pop('ingredients')
-
-        ingredient_names = set()
-        for ingredient in ingredients_data:
-            name = ingredient.get('id')
-            if name in ingredient_names:
-                raise serializers.ValidationError(
-                    'Нельзя использовать один и тот же ингредиент дважды'
-                )
-            ingredient_names.add(name)
-
         tags_data = validated_data.pop('tags')
 
-        tag_names = set()
-        for tag_data in tags_data:
-            if tag_data in tag_names:
-                raise serializers.ValidationError(
-                    'Нельзя использовать один и тот же тег дважды'
-                )
-            tag_names.add(tag_data)
-
-        recipe = Recipe.objects.create(**validated_data)
+        recipe = Recipe.objects.create(
+            ingredients_count=len(ingredients_data), **validated_data
+        )
         recipe.tags.set(tags_data)
+        schedule_renditions(recipe.image.name)
 
-        for ingredient_data in ingredients_data:
-            ingredient_id = ingredient_data['id']
-            amount = ingredient_data['amount']
-            RecipeIngridient.objects.create(
-                recipe=recipe, ingredient=ingredient_id, amount=amount
-            )
+        RecipeIngridient.objects.bulk_create([
+            RecipeIngridient(
+                recipe=recipe,
+                ingredient=ingredient_data['id'],
+                amount=ingredient_data['amount']
+            ) for ingredient_data in ingredients_data
+        ])
 
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        ingredients_data = validated_data.pop('ingredients', [])
-        tags_data = validated_data.pop('tags', [])
+        ingredients_data = validated_data.pop('ingredients', None)
+        tags_data = validated_data.pop('tags', None)
+        old_image = instance.image.name
 
-        instance.tags.clear()
-        instance.tags.set(tags_data)
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        if 'image' in validated_data:
+            instance.image_renditions = False
+        instance.save()
 
-        ingredients_list = []
-        for ingredient in ingredients_data:
-            name = ingredient.get('id')
-            amount = ingredient.get('amount')
-            if name in ingredients_list:
-                raise serializers.ValidationError(
-                    'Нельзя использовать один ингредиент дважды'
-                )
-            ingredients_list.append((name, amount))
+        if 'image' in validated_data:
+            schedule_renditions(instance.image.name)
+            if old_image != instance.image.name:
+                schedule_renditions_cleanup(old_image)
 
-        self.delete_unused_ingredients(instance, ingredients_data)
+        if tags_data is not None:
+            instance.tags.set(tags_data)
 
-        for name, amount in ingredients_list:
-            try:
-                RecipeIngridient.objects.create(
-                    recipe=instance.id, ingredient=name, amount=amount
-                )
-            except Exception:
-                RecipeIngridient.objects.filter(
-                    recipe_id=instance.id, ingredient=name, amount=amount
-                ).delete()
-                RecipeIngridient.objects.create(
-                    recipe_id=instance.id, ingredient=name, amount=amount
-                )
+        if ingredients_data is not None:
+            self.sync_ingredients(instance, ingredients_data)
 
         return instance
 
-    def delete_unused_ingredients(self, instance, ingredients_data):
-        ingredients_names = []
-        for ingredient in ingredients_data:
-            ingredient_obj = ingredient.get('id')
-            ingredients_names.append(ingredient_obj.name)
-
-        ingredients_in_recipe = RecipeIngridient.objects.filter(
-            recipe_id=instance.id
-        )
+    def sync_ingredients(self, instance, ingredients_data):
+        '''Изменяются только добавленные, удалённые и изменённые строки'''
+        current = {
+            recipe_ingredient.ingredient_id: recipe_ingredient
+            for recipe_ingredient in instance.recipeingridient_set.all()
+        }
+        amounts = {
+            ingredient_data['id'].id: ingredient_data['amount']
+            for ingredient_data in ingredients_data
+        }
+
+        to_create = []
+        to_update = []
+
+        for ingredient_id, amount in amounts.items():
+            recipe_ingredient = current.get(ingredient_id)
+
+            if recipe_ingredient is None:
+                to_create.append(RecipeIngridient(
+                    recipe=instance, ingredient_id=ingredient_id,
+                    amount=amount
+                ))
+            elif recipe_ingredient.amount != amount:
+                recipe_ingredient.amount = amount
+                to_update.append(recipe_ingredient)
+
+        to_delete = [
+            recipe_ingredient.id
+            for ingredient_id, recipe_ingredient in current.items()
+            if ingredient_id not in amounts
+        ]
 
-        for ingredient in ingredients_in_recipe:
-            if ingredient.ingredient not in ingredients_names:
-                ingredient.delete()
+        if to_delete:
+            RecipeIngridient.objects.filter(id__in=to_delete).delete()
+        if to_update:
+            RecipeIngridient.objects.bulk_update(to_update, ['amount'])
+        if to_create:
+            RecipeIngridient.objects.bulk_create(to_create)
+            # bulk_create не отправляет post_save, удаления учтены сигналом
+            change_counter(
+                Recipe, instance.id, 'ingredients_count', len(to_create)
+            )
 
     def to_representation(self, instance):
-        recipe_obj = super().to_representation(instance)
-        ingridients = recipe_obj.get('ingredients')
-        tags = recipe_obj.get('tags')
-
-        tags_list = []
-
-        for tag_id in tags:
-            tag_obj = Tag.objects.get(id=tag_id)
-            tags_list.append(tag_obj)
-
-        recipe_obj['tags'] = [
-            {
-                'id': tag.id,
-                'name': tag.name,
-                'color': tag.color,
-                'slug': tag.slug
-            } for tag in tags_list
-        ]
+        '''Теги и ингредиенты берутся из prefetch_related queryset'''
+        prefetch_related_objects([instance], *recipe_prefetches())
 
-        ingridients_list = []
+        if hasattr(instance, 'author_is_subscribed'):
+            instance.author.is_subscribed = instance.author_is_subscribed
 
-        for ingridient in ingridients:
-            ingredint_obj = RecipeIngridient.objects.get(
-                recipe_id=recipe_obj.get('id'),
-                ingredient_id=ingridient.get('id')
-            )
-            ingridients_list.append(ingredint_obj)
-
-        recipe_obj['ingredients'] = [
-            {
-                'id': ingridient.ingredient.id,
-                'name': ingridient.ingredient.name,
-                'measurement_unit': ingridient.ingredient.measurement_unit,
-                'amount': ingridient.amount
-            } for ingridient in ingridients_list
-        ]
+        recipe_obj = super().to_representation(instance)
+
+        recipe_obj['tags'] = TagSerializer(
+            instance.tags.all(), many=True
+        ).data
+        recipe_obj['ingredients'] = RecipeIngridientReadSerializer(
+            instance.recipeingridient_set.all(), many=True
+        ).data
 
         return recipe_obj
+
+
+class CookableRecipeSerializer(RecipeSerializer):
+    matched_ingredients = serializers.IntegerField(read_only=True)
+    coverage = serializers.FloatField(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + (
+            'matched_ingredients', 'coverage'
+        )
+
+
+class CookableQuerySerializer(serializers.Serializer):
+    '''Параметры подбора рецептов по имеющимся ингредиентам'''
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        min_length=1, max_length=MAX_PANTRY_INGREDIENTS
+    )
+    min_coverage = serializers.FloatField(
+        min_value=0, max_value=1, default=DEFAULT_MIN_COVERAGE
+    )
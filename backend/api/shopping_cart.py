@@ -0,0 +1,73 @@
+import csv
+import json
+
+from django.db.models import Sum
+
+from recipes.models import RecipeIngridient
+
+HEADERS = ('Название', 'Количество', 'Единица измерения')
+
+
+def cart_ingredients(user):
+    '''Ингредиенты из рецептов списка покупок, сгруппированные в SQL'''
+    return RecipeIngridient.objects.filter(
+        recipe__shoppingcart__user=user
+    ).values(
+        'ingredient__name', 'ingredient__measurement_unit'
+    ).annotate(
+        amount=Sum('amount')
+    ).order_by('ingredient__name')
+
+
+class Echo:
+    '''Псевдо-буфер для csv.writer: возвращает строку вместо записи'''
+
+    def write(self, value):
+        return value
+
+
+def render_txt(ingredients):
+    for item in ingredients:
+        yield '{} ({}) — {}\n'.format(
+            item['ingredient__name'],
+            item['ingredient__measurement_unit'],
+            item['amount']
+        )
+
+
+def render_csv(ingredients):
+    writer = csv.writer(Echo())
+    yield writer.writerow(HEADERS)
+
+    for item in ingredients:
+        yield writer.writerow((
+            item['ingredient__name'],
+            item['amount'],
+            item['ingredient__measurement_unit']
+        ))
+
+
+def render_json(ingredients):
+    yield '{'
+
+    for index, item in enumerate(ingredients):
+        yield '{}{}: {}'.format(
+            ', ' if index else '',
+            json.dumps(item['ingredient__name'], ensure_ascii=False),
+            json.dumps(
+                {
+                    HEADERS[1]: item['amount'],
+                    HEADERS[2]: item['ingredient__measurement_unit']
+                },
+                ensure_ascii=False
+            )
+        )
+
+    yield '}'
+
+
+FORMATS = {
+    'txt': ('text/plain; charset=utf-8', render_txt),
+    'csv': ('text/csv; charset=utf-8', render_csv),
+    'json': ('application/json; charset=utf-8', render_json),
+}
@@ -0,0 +1,219 @@
+from time import monotonic
+
+from django.conf import settings
+from django.core.signals import request_finished, request_started
+from django.db import connections, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from recipes.models import (Favorite, Ingridient, Recipe, RecipeIngridient,
+                            ShoppingCart, Tag)
+from users.models import CustomUser, Follow
+
+from .authentication import invalidate_cached_tokens
+from .catalog_cache import ingredients_cache, tags_cache
+from .counters import update_counters
+from .feed import invalidate_followers_feeds
+from .images import schedule_renditions_cleanup
+from .ingredient_search import ingredient_search_index
+from .paginators import invalidate_counts
+from .recipe_cache import invalidate_all_recipes, invalidate_recipes
+from .recipe_search import refresh_search_vectors
+
+PRIVATE_USER_FIELDS = {'last_login', 'password'}
+
+
+@receiver([post_save, post_delete], sender=Ingridient)
+def invalidate_ingredients_catalog(sender, **kwargs):
+    ingredients_cache.invalidate()
+    ingredient_search_index.invalidate()
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def invalidate_tags_catalog(sender, **kwargs):
+    tags_cache.invalidate()
+
+
+@receiver([post_save, post_delete], sender=Token)
+def invalidate_cached_token(sender, instance, **kwargs):
+    invalidate_cached_tokens(instance.key)
+
+
+@receiver(post_save, sender=CustomUser)
+def invalidate_user_tokens(sender, instance, created, **kwargs):
+    if created or not settings.AUTH_TOKEN_CACHE_TTL:
+        return
+
+    invalidate_cached_tokens(
+        *Token.objects.filter(user=instance).values_list('key', flat=True)
+    )
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=RecipeIngridient)
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Follow)
+def increment_counters(sender, instance, created, raw=False, **kwargs):
+    '''bulk_create сигналов не отправляет, такие строки учитывает вызывающий'''
+    if created and not raw:
+        update_counters(instance, 1)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_delete, sender=RecipeIngridient)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Follow)
+def decrement_counters(sender, instance, **kwargs):
+    '''Удаления из API, админки и каскадные удаления'''
+    update_counters(instance, -1)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=CustomUser)
+def invalidate_counts_on_create(sender, created, **kwargs):
+    if created:
+        invalidate_counts(sender)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_counts_on_delete(sender, **kwargs):
+    invalidate_counts(sender)
+
+
+def invalidate_recipes_on_commit(recipe_ids):
+    recipe_ids = list(recipe_ids)
+    if recipe_ids:
+        transaction.on_commit(lambda: invalidate_recipes(*recipe_ids))
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def invalidate_cached_recipe(sender, instance, **kwargs):
+    invalidate_recipes_on_commit([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=RecipeIngridient)
+def invalidate_cached_recipe_ingredients(sender, instance, **kwargs):
+    invalidate_recipes_on_commit([instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_cached_recipe_tags(sender, instance, action, reverse, pk_set,
+                                  **kwargs):
+    if not action.startswith('post_'):
+        return
+
+    if not reverse:
+        invalidate_recipes_on_commit([instance.pk])
+    elif pk_set is not None:
+        invalidate_recipes_on_commit(pk_set)
+    else:
+        transaction.on_commit(invalidate_all_recipes)
+
+
+@receiver(post_save, sender=Tag)
+def invalidate_cached_tag_recipes(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_recipes_on_commit(Recipe.tags.through.objects.filter(
+            tag=instance
+        ).values_list('recipe_id', flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+def invalidate_cached_recipes_on_tag_delete(sender, **kwargs):
+    '''Связи с тегом удаляются без сигналов, рецепты уже не найти'''
+    transaction.on_commit(invalidate_all_recipes)
+
+
+@receiver(post_save, sender=Ingridient)
+def invalidate_cached_ingredient_recipes(sender, instance, created,
+                                         **kwargs):
+    if not created:
+        invalidate_recipes_on_commit(RecipeIngridient.objects.filter(
+            ingredient=instance
+        ).values_list('recipe_id', flat=True))
+
+
+@receiver(post_save, sender=CustomUser)
+def invalidate_cached_author_recipes(sender, instance, created,
+                                     update_fields=None, **kwargs):
+    if created or update_fields and set(update_fields) <= PRIVATE_USER_FIELDS:
+        return
+
+    invalidate_recipes_on_commit(Recipe.objects.filter(
+        author=instance
+    ).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Recipe)
+def refresh_feeds_on_publish(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(
+            lambda: invalidate_followers_feeds(instance.author_id)
+        )
+
+
+@receiver(post_delete, sender=Recipe)
+def refresh_feeds_on_delete(sender, instance, **kwargs):
+    transaction.on_commit(
+        lambda: invalidate_followers_feeds(instance.author_id)
+    )
+
+
+@receiver(post_delete, sender=Recipe)
+def delete_image_renditions(sender, instance, **kwargs):
+    schedule_renditions_cleanup(instance.image.name)
+
+
+@receiver(request_finished)
+def mark_connections_idle(sender, **kwargs):
+    now = monotonic()
+
+    for connection in connections.all():
+        if connection.connection is not None:
+            connection.idle_since = now
+
+
+@receiver(request_started)
+def close_unusable_connections(sender, **kwargs):
+    '''Соединение проверяется один раз, если оно долго простаивало
+
+    При постоянной нагрузке соединение переиспользуется без лишнего
+    SELECT 1, а разрыв во время работы закрывает close_old_connections
+    по errors_occurred.
+    '''
+    if not settings.DB_CONN_HEALTH_CHECKS:
+        return
+
+    now = monotonic()
+
+    for connection in connections.all():
+        idle_since = getattr(connection, 'idle_since', None)
+        connection.idle_since = None
+
+        if (
+            connection.connection is not None
+            and idle_since is not None
+            and now - idle_since >= settings.DB_CONN_HEALTH_CHECK_IDLE
+            and not connection.is_usable()
+        ):
+            connection.close()
+
+
+@receiver(post_save, sender=Recipe)
+def refresh_recipe_search_vector(sender, instance, **kwargs):
+    '''Ингредиенты сохраняются после рецепта, поэтому пересчёт - на коммите'''
+    transaction.on_commit(lambda: refresh_search_vectors(
+        Recipe.objects.filter(pk=instance.pk)
+    ))
+
+
+@receiver(post_save, sender=Ingridient)
+def refresh_ingredient_search_vectors(sender, instance, created, **kwargs):
+    if not created:
+        transaction.on_commit(lambda: refresh_search_vectors(
+            Recipe.objects.filter(ingredients=instance)
+        ))
@@ -0,0 +1,627 @@
+import csv
+import json
+import re
+import shutil
+import tempfile
+
+from django.core.cache import caches
+from django.test import AsyncClient, TestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from foodgram_backend.constants import DEFAULT_PAGE_SIZE
+from recipes.models import (Favorite, Ingridient, Recipe, RecipeIngridient,
+                            ShoppingCart, Tag)
+from users.models import CustomUser, Follow
+
+MEDIA_ROOT = tempfile.mkdtemp()
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=='
+)
+
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tests-default',
+    },
+    'versions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tests-versions',
+    },
+}
+
+
+def tearDownModule():
+    shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+
+def create_user(username):
+    return CustomUser.objects.create(
+        username=username, email=f'{username}@example.com',
+        first_name=username.title(), last_name=username.title()
+    )
+
+
+def create_recipe(author, name, tags=(), ingredients=()):
+    '''Рецепт со связями через create(), чтобы сработали сигналы'''
+    recipe = Recipe.objects.create(
+        author=author, name=name, description='Описание',
+        image='recipes/images/test.png', cooking_time=10
+    )
+    recipe.tags.set(tags)
+    for ingredient, amount in ingredients:
+        RecipeIngridient.objects.create(
+            recipe=recipe, ingredient=ingredient, amount=amount
+        )
+
+    return recipe
+
+
+class APITestCase(TestCase):
+    '''Кэши очищаются перед каждым тестом'''
+
+    def setUp(self):
+        for alias in TEST_CACHES:
+            caches[alias].clear()
+
+    def client_for(self, user=None):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+
+        return client
+
+    def names(self, response):
+        self.assertEqual(response.status_code, 200, response.content)
+
+        return sorted(recipe['name'] for recipe in response.data['results'])
+
+
+@override_settings(
+    CACHES=TEST_CACHES, RECIPE_CACHE_TTL=0, AUTH_TOKEN_CACHE_TTL=0
+)
+class RecipeQueriesTest(APITestCase):
+    '''Число запросов к базе не зависит от числа рецептов на странице
+
+    Кэш ответов и токенов отключён, чтобы считались запросы самих
+    представлений.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = CustomUser.objects.create(
+            username='author', email='author@example.com',
+            first_name='Author', last_name='Author'
+        )
+        cls.token = Token.objects.create(user=cls.author)
+        cls.tags = [
+            Tag.objects.create(
+                name=f'Тег {index}', color='#E26C2D', slug=f'tag{index}'
+            )
+            for index in range(3)
+        ]
+        cls.ingredients = [
+            Ingridient.objects.create(
+                name=f'ингредиент {index}', measurement_unit='г'
+            )
+            for index in range(4)
+        ]
+        cls.recipe = cls.create_recipes(5)[-1]
+
+    @classmethod
+    def create_recipes(cls, number):
+        recipes = []
+
+        for index in range(number):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {index}',
+                description='Описание', image='recipes/images/test.png',
+                cooking_time=10
+            )
+            recipe.tags.set(cls.tags)
+            RecipeIngridient.objects.bulk_create(
+                RecipeIngridient(
+                    recipe=recipe, ingredient=ingredient, amount=10
+                )
+                for ingredient in cls.ingredients
+            )
+            recipes.append(recipe)
+
+        return recipes
+
+    def setUp(self):
+        super().setUp()
+        self.anonymous = APIClient()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_list_anonymous(self):
+        # слаги тегов, COUNT, рецепты, теги, ингредиенты
+        with self.assertNumQueries(5):
+            response = self.anonymous.get('/api/recipes/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 5)
+
+    def test_list_authenticated(self):
+        # плюс токен, флаги пользователя считаются в запросе рецептов
+        with self.assertNumQueries(6):
+            response = self.client.get('/api/recipes/')
+
+        self.assertEqual(response.status_code, 200)
+        recipe = response.data['results'][0]
+        self.assertEqual(len(recipe['tags']), 3)
+        self.assertEqual(len(recipe['ingredients']), 4)
+        self.assertFalse(recipe['is_favorited'])
+
+    def test_list_does_not_grow_with_page(self):
+        self.create_recipes(5)
+
+        with self.assertNumQueries(6):
+            response = self.client.get('/api/recipes/')
+
+        self.assertEqual(len(response.data['results']), DEFAULT_PAGE_SIZE)
+
+    def test_detail_anonymous(self):
+        # слаги тегов для фильтра, рецепт, теги, ингредиенты
+        with self.assertNumQueries(4):
+            response = self.anonymous.get(f'/api/recipes/{self.recipe.id}/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['ingredients']), 4)
+
+    def test_detail_authenticated(self):
+        with self.assertNumQueries(5):
+            response = self.client.get(f'/api/recipes/{self.recipe.id}/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.data['author']['is_subscribed'])
+
+
+@override_settings(CACHES=TEST_CACHES, SERVER_TIMING=True)
+class RequestMetricsTest(TestCase):
+    '''SQL считается и в потоках sync_to_async под ASGI'''
+
+    @classmethod
+    def setUpTestData(cls):
+        CustomUser.objects.create(
+            username='user', email='user@example.com',
+            first_name='User', last_name='User'
+        )
+
+    def queries(self, response):
+        return int(re.search(r'"(\d+) queries"', response['Server-Timing'])[1])
+
+    def test_sync(self):
+        self.assertGreater(self.queries(self.client.get('/api/users/')), 0)
+
+    async def test_async(self):
+        response = await AsyncClient().get('/api/users/')
+
+        self.assertGreater(self.queries(response), 0)
+
+
+@override_settings(CACHES=TEST_CACHES, RECIPE_CACHE_TTL=0)
+class RecipeFiltersTest(APITestCase):
+    '''Флаги пользователя и теги в фильтрах списка рецептов'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        cls.other = create_user('other')
+        breakfast, lunch, dinner = (
+            Tag.objects.create(name=slug, color='#E26C2D', slug=slug)
+            for slug in ('breakfast', 'lunch', 'dinner')
+        )
+        first = create_recipe(cls.other, 'first', [breakfast, lunch])
+        second = create_recipe(cls.other, 'second', [lunch])
+        third = create_recipe(cls.other, 'third', [dinner])
+        Favorite.objects.create(user=cls.user, recipe=first)
+        Favorite.objects.create(user=cls.other, recipe=second)
+        ShoppingCart.objects.create(user=cls.user, recipe=third)
+
+    def test_favorited_is_per_user(self):
+        path = '/api/recipes/?is_favorited=1'
+
+        self.assertEqual(self.names(self.client_for(self.user).get(path)),
+                         ['first'])
+        self.assertEqual(self.names(self.client_for(self.other).get(path)),
+                         ['second'])
+
+    def test_not_favorited(self):
+        response = self.client_for(self.user).get(
+            '/api/recipes/?is_favorited=0'
+        )
+
+        self.assertEqual(self.names(response), ['second', 'third'])
+
+    def test_in_shopping_cart_is_per_user(self):
+        path = '/api/recipes/?is_in_shopping_cart=1'
+
+        self.assertEqual(self.names(self.client_for(self.user).get(path)),
+                         ['third'])
+        self.assertEqual(self.names(self.client_for(self.other).get(path)),
+                         [])
+
+    def test_anonymous_user_flags(self):
+        client = self.client_for()
+
+        self.assertEqual(
+            self.names(client.get('/api/recipes/?is_favorited=1')), []
+        )
+        self.assertEqual(
+            self.names(client.get('/api/recipes/?is_in_shopping_cart=0')),
+            ['first', 'second', 'third']
+        )
+
+    def test_tags_any(self):
+        response = self.client_for().get(
+            '/api/recipes/?tags=breakfast&tags=dinner'
+        )
+
+        self.assertEqual(self.names(response), ['first', 'third'])
+
+    def test_tags_all(self):
+        client = self.client_for()
+
+        self.assertEqual(self.names(client.get(
+            '/api/recipes/?tags=breakfast&tags=lunch&tags_mode=all'
+        )), ['first'])
+        self.assertEqual(self.names(client.get(
+            '/api/recipes/?tags=lunch&tags=dinner&tags_mode=all'
+        )), [])
+
+    def test_unknown_tag(self):
+        response = self.client_for().get('/api/recipes/?tags=unknown')
+
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(
+    CACHES=TEST_CACHES, MEDIA_ROOT=MEDIA_ROOT, RECIPE_CACHE_TTL=0
+)
+class RecipeIngredientsSyncTest(APITestCase):
+    '''Запись рецепта меняет только изменившиеся строки ингредиентов'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.tag = Tag.objects.create(
+            name='Тег', color='#E26C2D', slug='tag'
+        )
+        cls.ingredients = [
+            Ingridient.objects.create(
+                name=f'ингредиент {index}', measurement_unit='г'
+            )
+            for index in range(4)
+        ]
+
+    def recipe_data(self, amounts):
+        return {
+            'name': 'Pancakes', 'text': 'Описание', 'cooking_time': 10,
+            'image': IMAGE, 'tags': [self.tag.id],
+            'ingredients': [
+                {'id': self.ingredients[index].id, 'amount': amount}
+                for index, amount in amounts.items()
+            ],
+        }
+
+    def rows(self, recipe_id):
+        return {
+            row.ingredient_id: (row.id, row.amount)
+            for row in RecipeIngridient.objects.filter(recipe_id=recipe_id)
+        }
+
+    def test_create(self):
+        response = self.client_for(self.author).post(
+            '/api/recipes/', self.recipe_data({0: 10, 1: 20}), format='json'
+        )
+
+        self.assertEqual(response.status_code, 201, response.content)
+        recipe = Recipe.objects.get(id=response.data['id'])
+        self.assertEqual(recipe.ingredients_count, 2)
+
+    def test_update_diff(self):
+        first, second, third, fourth = self.ingredients
+        recipe = create_recipe(
+            self.author, 'Рецепт', [self.tag],
+            [(first, 10), (second, 20), (third, 30)]
+        )
+        before = self.rows(recipe.id)
+
+        response = self.client_for(self.author).patch(
+            f'/api/recipes/{recipe.id}/',
+            self.recipe_data({0: 10, 1: 25, 3: 40}), format='json'
+        )
+
+        self.assertEqual(response.status_code, 200, response.content)
+        after = self.rows(recipe.id)
+        self.assertEqual(after[first.id], before[first.id])
+        self.assertEqual(after[second.id], (before[second.id][0], 25))
+        self.assertNotIn(third.id, after)
+        self.assertEqual(after[fourth.id][1], 40)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.ingredients_count, 3)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ShoppingCartExportTest(APITestCase):
+    '''Ингредиенты списка покупок суммируются по названию и единице'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        flour = Ingridient.objects.create(name='мука', measurement_unit='г')
+        milk = Ingridient.objects.create(name='молоко', measurement_unit='мл')
+        for name, ingredients in (
+            ('блины', [(flour, 200), (milk, 500)]),
+            ('оладьи', [(flour, 300)]),
+        ):
+            ShoppingCart.objects.create(
+                user=cls.user,
+                recipe=create_recipe(cls.user, name, ingredients=ingredients)
+            )
+
+    def download(self, user, file_format):
+        response = self.client_for(user).get(
+            f'/api/recipes/download_shopping_cart/?file_format={file_format}'
+        )
+        if response.status_code != 200:
+            return response, None
+
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_txt(self):
+        response, content = self.download(self.user, 'txt')
+
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertEqual(
+            content, 'молоко (мл) — 500\nмука (г) — 500\n'
+        )
+
+    def test_csv(self):
+        _, content = self.download(self.user, 'csv')
+
+        self.assertEqual(list(csv.reader(content.splitlines())), [
+            ['Название', 'Количество', 'Единица измерения'],
+            ['молоко', '500', 'мл'],
+            ['мука', '500', 'г'],
+        ])
+
+    def test_json(self):
+        _, content = self.download(self.user, 'json')
+
+        self.assertEqual(json.loads(content), {
+            'мука': {'Количество': 500, 'Единица измерения': 'г'},
+            'молоко': {'Количество': 500, 'Единица измерения': 'мл'},
+        })
+
+    def test_empty_cart(self):
+        response, _ = self.download(create_user('empty'), 'txt')
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_unknown_format(self):
+        response, _ = self.download(self.user, 'xml')
+
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES=TEST_CACHES, RECIPE_CACHE_TTL=0, COUNT_CACHE_TTL=60)
+class CountCacheTest(APITestCase):
+    '''COUNT кэшируется и сбрасывается при создании рецепта'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        create_recipe(cls.author, 'first')
+
+    def count(self):
+        return self.client_for().get('/api/recipes/').data['count']
+
+    def test_invalidated_after_create(self):
+        self.assertEqual(self.count(), 1)
+
+        # bulk_create сигналов не отправляет, COUNT остаётся из кэша
+        Recipe.objects.bulk_create([Recipe(
+            author=self.author, name='bulk', description='Описание',
+            image='recipes/images/test.png', cooking_time=10
+        )])
+        self.assertEqual(self.count(), 1)
+
+        create_recipe(self.author, 'second')
+        self.assertEqual(self.count(), 3)
+
+
+@override_settings(CACHES=TEST_CACHES, RECIPE_CACHE_TTL=60)
+class RecipeCacheTest(APITestCase):
+    '''Общий ответ из кэша и флаги пользователя поверх него'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.user = create_user('user')
+        cls.favorite = create_recipe(cls.author, 'favorite')
+        cls.other = create_recipe(cls.author, 'other')
+        Favorite.objects.create(user=cls.user, recipe=cls.favorite)
+        ShoppingCart.objects.create(user=cls.user, recipe=cls.other)
+        Follow.objects.create(user=cls.user, following=cls.author)
+
+    def flags(self, response):
+        return {
+            recipe['name']: (
+                recipe['is_favorited'], recipe['is_in_shopping_cart'],
+                recipe['author']['is_subscribed']
+            )
+            for recipe in response.data['results']
+        }
+
+    def test_miss_then_hit(self):
+        client = self.client_for()
+
+        self.assertEqual(client.get('/api/recipes/')['X-Cache'], 'MISS')
+        self.assertEqual(client.get('/api/recipes/')['X-Cache'], 'HIT')
+
+    def test_user_flags_over_cached_body(self):
+        self.client_for().get('/api/recipes/')
+
+        response = self.client_for(self.user).get('/api/recipes/')
+
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(self.flags(response), {
+            'favorite': (True, False, True),
+            'other': (False, True, True),
+        })
+        response = self.client_for(self.author).get('/api/recipes/')
+        self.assertEqual(self.flags(response), {
+            'favorite': (False, False, False),
+            'other': (False, False, False),
+        })
+
+    def test_detail_user_flags(self):
+        path = f'/api/recipes/{self.favorite.id}/'
+        self.client_for().get(path)
+
+        response = self.client_for(self.user).get(path)
+
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertTrue(response.data['is_favorited'])
+        self.assertTrue(response.data['author']['is_subscribed'])
+
+    def test_write_invalidates_only_changed_recipe(self):
+        client = self.client_for()
+        for path in (
+            '/api/recipes/', f'/api/recipes/{self.favorite.id}/',
+            f'/api/recipes/{self.other.id}/'
+        ):
+            client.get(path)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.name = 'renamed'
+            self.other.save()
+
+        self.assertEqual(client.get('/api/recipes/')['X-Cache'], 'MISS')
+        self.assertEqual(
+            client.get(f'/api/recipes/{self.favorite.id}/')['X-Cache'], 'HIT'
+        )
+        response = client.get(f'/api/recipes/{self.other.id}/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(json.loads(response.content)['name'], 'renamed')
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CountersTest(APITestCase):
+    '''Счётчики при добавлении, удалении и каскадном удалении строк'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.recipe = create_recipe(cls.author, 'recipe')
+
+    def assertCounters(self, **expected):
+        self.recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        counters = {
+            field: getattr(
+                self.recipe if hasattr(self.recipe, field) else self.author,
+                field
+            )
+            for field in expected
+        }
+
+        self.assertEqual(counters, expected)
+
+    def test_recipe_relations(self):
+        for suffix, field in (
+            ('favorite', 'favorites_count'),
+            ('shopping_cart', 'shopping_cart_count'),
+        ):
+            with self.subTest(suffix):
+                path = f'/api/recipes/{self.recipe.id}/{suffix}/'
+                user = create_user(f'{suffix}_user')
+                client = self.client_for(user)
+
+                self.assertEqual(client.post(path).status_code, 201)
+                self.assertCounters(**{field: 1})
+                self.assertEqual(client.delete(path).status_code, 204)
+                self.assertCounters(**{field: 0})
+
+                client.post(path)
+                user.delete()
+                self.assertCounters(**{field: 0})
+
+    def test_followers(self):
+        path = f'/api/users/{self.author.id}/subscribe/'
+        user = create_user('follower')
+        client = self.client_for(user)
+
+        self.assertEqual(client.post(path).status_code, 201)
+        self.assertCounters(followers_count=1)
+        self.assertEqual(client.delete(path).status_code, 204)
+        self.assertCounters(followers_count=0)
+
+        client.post(path)
+        user.delete()
+        self.assertCounters(followers_count=0)
+
+    def test_recipes(self):
+        self.assertCounters(recipes_count=1)
+
+        create_recipe(self.author, 'second').delete()
+
+        self.assertCounters(recipes_count=1)
+
+    def test_full_save_keeps_counters(self):
+        stale = Recipe.objects.get(id=self.recipe.id)
+        Favorite.objects.create(user=create_user('user'), recipe=self.recipe)
+
+        stale.name = 'renamed'
+        stale.save()
+
+        self.assertCounters(favorites_count=1)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CookableRecipesTest(APITestCase):
+    '''Подбор рецептов по имеющимся ингредиентам'''
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user('author')
+        cls.flour, cls.milk, cls.egg = (
+            Ingridient.objects.create(name=name, measurement_unit='г')
+            for name in ('мука', 'молоко', 'яйцо')
+        )
+        create_recipe(author, 'блины', ingredients=[
+            (cls.flour, 200), (cls.milk, 500), (cls.egg, 2)
+        ])
+        create_recipe(author, 'лепёшки', ingredients=[(cls.flour, 300)])
+
+    def test_ranked_by_coverage(self):
+        response = self.client_for().get(
+            f'/api/recipes/can_cook/?ingredients={self.flour.id}'
+            f'&ingredients={self.milk.id}&min_coverage=0.5'
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [
+                (recipe['name'], recipe['matched_ingredients'])
+                for recipe in response.data['results']
+            ],
+            [('лепёшки', 1), ('блины', 2)]
+        )
+
+    def test_bad_input(self):
+        for query in (
+            '', 'ingredients=abc', 'ingredients=0',
+            f'ingredients={self.flour.id}&min_coverage=2',
+            f'ingredients={self.flour.id}&min_coverage=abc',
+        ):
+            with self.subTest(query):
+                response = self.client_for().get(
+                    f'/api/recipes/can_cook/?{query}'
+                )
+
+                self.assertEqual(response.status_code, 400)
@@ -1,8 +1,13 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework import routers
 
-from .views import (ChangePasswordViewSet, FavoriteViewSet, IngredientsViewSet,
-                    RecipeViewSet, ShoppingCartViewSet, SubscribeViewSet,
+from . import async_views
+from .views import (ChangePasswordViewSet, CookableRecipesViewSet,
+                    FavoriteViewSet, FollowedRecipesViewSet,
+                    IngredientsViewSet, RecipeViewSet,
+                    RecommendedRecipesViewSet, ShoppingCartViewSet,
+                    SimilarRecipesViewSet, SubscribeViewSet,
                     SubscriptionsListViewSet, TagViewSet, UserViewSet,
                     download_shopping_cart, get_token, logout)
 
@@ -12,8 +17,26 @@ router.register(r'tags', TagViewSet)
 router.register(r'ingredients', IngredientsViewSet)
 router.register(r'users', UserViewSet)
 
-urlpatterns = [
+urlpatterns = []
+
+if settings.ASGI_MODE:
+    urlpatterns += [
+        path('tags/', async_views.tags_list),
+        path('ingredients/', async_views.ingredients_list),
+    ]
+
+urlpatterns += [
     path('recipes/download_shopping_cart/', download_shopping_cart),
+    path('recipes/feed/', FollowedRecipesViewSet.as_view({'get': 'list'})),
+    path('recipes/can_cook/', CookableRecipesViewSet.as_view(
+        {'get': 'list'}
+    )),
+    path('recipes/recommended/', RecommendedRecipesViewSet.as_view(
+        {'get': 'list'}
+    )),
+    path('recipes/<int:pk>/similar/', SimilarRecipesViewSet.as_view(
+        {'get': 'list'}
+    )),
     path('recipes/<int:pk>/favorite/', FavoriteViewSet.as_view(
         {'post': 'create', 'delete': 'destroy'}
     )),
@@ -1,12 +1,14 @@
-import json
+from itertools import chain
 
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
 from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.db.utils import IntegrityError
-from django.http import HttpResponse
-from django.shortcuts import get_list_or_404, get_object_or_404
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import filters, mixins, serializers, status, viewsets
+from rest_framework import mixins, serializers, status, viewsets
 from rest_framework.authtoken.models import Token
 from rest_framework.decorators import (api_view, authentication_classes,
                                        permission_classes)
@@ -14,26 +16,60 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
 
-from foodgram_backend.constants import MAX_API_KEY_LENGHT
-from recipes.models import (Favorite, Ingridient, Recipe, RecipeIngridient,
-                            ShoppingCart, Tag)
+from foodgram_backend.constants import (DEFAULT_PAGE_SIZE, MAX_API_KEY_LENGHT,
+                                        MAX_INGREDIENT_SEARCH_RESULTS,
+                                        RECOMMENDATION_NEIGHBORS)
+from recipes.models import Favorite, Ingridient, Recipe, ShoppingCart, Tag
 from users.models import CustomUser, Follow
 from users.permissions import IsAdminOrAuthorOrReadOnly
 
 from .authentication import APIKeyAuthentication
-from .filters import IngredientFilter, RecipeFilter
-from .paginators import RecipePagination, UserPagination
-from .serializers import (CreateUserSerializer, FavoriteSerializer,
+from .catalog_cache import catalog_response, ingredients_cache, tags_cache
+from .feed import cached_feed_ids, followed_recipes, invalidate_feeds
+from .filters import IngredientFilter, RecipeFilter, RecipeOrderingFilter
+from .ingredient_search import ingredient_search_index
+from .paginators import (RecipeCursorPagination, RecipeFeedPagination,
+                         RecipePagination, SubscriptionsPagination,
+                         UserListPagination)
+from .querysets import (annotate_is_subscribed, annotate_recipe_flags,
+                        cookable_recipes, prefetch_subscription_recipes,
+                        recipe_prefetches)
+from .recipe_cache import (cached_recipe_response, is_cacheable,
+                           recipe_cache_key, recipe_details_cache,
+                           recipes_cache)
+from .recommendations import recommended_recipe_ids, similar_recipes
+from .serializers import (CookableQuerySerializer, CookableRecipeSerializer,
+                          CreateUserSerializer, FavoriteSerializer,
                           FollowSerializer, IngridientSerializer,
-                          RecipeSerializer, ResetPasswordSerializer,
+                          RecipeSerializer, RecipesInSubscriptionsSerializer,
+                          ResetPasswordSerializer,
                           ShoppingCartSerializer, TagSerializer,
                           UserSerializer)
+from .shopping_cart import FORMATS as SHOPPING_CART_FORMATS, cart_ingredients
 
 REQUIRED_DATA = [
     'email', 'username', 'first_name', 'last_name', 'password'
 ]
 
 
+def get_limit(request, maximum):
+    '''Значение limit из запроса в пределах от 1 до maximum'''
+    try:
+        limit = int(request.GET.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        limit = DEFAULT_PAGE_SIZE
+
+    return min(max(limit, 1), maximum)
+
+
+def get_recipes_limit(request):
+    '''Значение recipes_limit из запроса, 0 - без ограничения'''
+    try:
+        return max(int(request.GET.get('recipes_limit', 0)), 0)
+    except ValueError:
+        return 0
+
+
 @api_view(['POST'])
 @authentication_classes([APIKeyAuthentication])
 @permission_classes([AllowAny])
@@ -157,7 +193,7 @@ class ChangePasswordViewSet(
                 )
 
             user.set_password(new_password)
-            user.save()
+            user.save(update_fields=['password'])
 
         else:
 
@@ -175,9 +211,14 @@ class UserViewSet(viewsets.ModelViewSet):
     queryset = CustomUser.objects.all()
     serializer_class = UserSerializer
     permission_classes = [AllowAny]
-    pagination_class = UserPagination
+    pagination_class = UserListPagination
     http_method_names = ['get', 'post']
 
+    def get_queryset(self):
+        return annotate_is_subscribed(
+            CustomUser.objects.order_by('id'), self.request.user
+        )
+
     def retrieve(self, request, *args, **kwargs):
         if kwargs.get('pk') == 'me':
             if isinstance(request.user, AnonymousUser):
@@ -187,13 +228,13 @@ class UserViewSet(viewsets.ModelViewSet):
                 )
 
             instance = get_object_or_404(
-                CustomUser, username=request.user.username
+                self.get_queryset(), username=request.user.username
             )
             serializer = self.get_serializer(instance)
 
             return Response(serializer.data)
 
-        instance = get_object_or_404(CustomUser, pk=kwargs.get('pk'))
+        instance = get_object_or_404(self.get_queryset(), pk=kwargs.get('pk'))
         serializer = self.get_serializer(instance)
 
         return Response(serializer.data)
@@ -240,37 +281,26 @@ class SubscriptionsListViewSet(
 ):
     queryset = Follow.objects.all()
     serializer_class = FollowSerializer
-    pagination_class = UserPagination
+    pagination_class = SubscriptionsPagination
+    permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Follow.objects.filter(user=self.request.user)
+        return Follow.objects.filter(
+            user=self.request.user
+        ).select_related('following').order_by('following__id')
 
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset().order_by('following__id')
-        serializer = self.get_serializer(self.get_queryset(), many=True)
-        data = serializer.data
-
-        recipes_limit = int(request.GET.get('recipes_limit', 0))
-        if recipes_limit > 0:
-
-            if len(data) == 1:
-                index = 0
-                data[index]['recipes'] = data[index]['recipes'][:recipes_limit]
-            else:
-
-                for index in range(len(data) - 1):
-                    data[index]['recipes'] = data[
-                        index
-                    ]['recipes'][:recipes_limit]
-
+        queryset = self.get_queryset()
         page = self.paginate_queryset(queryset)
+        follows = list(queryset) if page is None else page
 
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
+        prefetch_subscription_recipes(follows, get_recipes_limit(request))
+        serializer = self.get_serializer(follows, many=True)
 
-            return self.get_paginated_response(data)
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
 
-        return Response(data, status=status.HTTP_200_OK)
+        return Response(serializer.data, status=status.HTTP_200_OK)
 
 
 class SubscribeViewSet(
@@ -280,9 +310,6 @@ class SubscribeViewSet(
 
     def create(self, request, *args, **kwargs):
         serializer = FollowSerializer(data=request.data)
-        user = get_object_or_404(
-            CustomUser, username=request.user.username
-        )
 
         try:
             following = get_object_or_404(CustomUser, id=self.kwargs['pk'])
@@ -294,32 +321,29 @@ class SubscribeViewSet(
 
         if serializer.is_valid():
 
-            if Follow.objects.filter(
-                user=user, following__id=following.id
-            ).exists():
+            if request.user.id == following.id:
                 return Response(
-                    {'error': 'Вы уже подписаны'},
+                    {'error': 'Нельзя подписаться на себя'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            if user.id == following.id:
+            try:
+                with transaction.atomic():
+                    follow = serializer.save(
+                        user=request.user, following=following
+                    )
+                    invalidate_feeds([request.user.id])
+            except IntegrityError:
                 return Response(
-                    {'error': 'Нельзя подписаться на себя'},
+                    {'error': 'Вы уже подписаны'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            serializer.save(
-                user=request.user,
-                following=CustomUser.objects.get(id=following.id)
+            prefetch_subscription_recipes(
+                [follow], get_recipes_limit(request)
             )
 
-            recipes_limit = int(request.GET.get('recipes_limit', 0))
-            data = serializer.data
-
-            if recipes_limit > 0 and 'recipes' in data:
-                data['recipes'] = data['recipes'][:recipes_limit]
-
-            return Response(data, status=status.HTTP_201_CREATED)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -332,21 +356,19 @@ class SubscribeViewSet(
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        try:
-            follow = get_object_or_404(
-                Follow, user=request.user.id, following=following.id
-            )
-        except Exception as error:
+        with transaction.atomic():
+            deleted, _ = Follow.objects.filter(
+                user=request.user, following=following
+            ).delete()
+            if deleted:
+                invalidate_feeds([request.user.id])
+
+        if not deleted:
             return Response(
-                {
-                    'error': f'Вы не подписаны на '
-                    f'этотого пользователя - {error}'
-                },
+                {'error': 'Вы не подписаны на этого пользователя'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        follow.delete()
-
         return Response(
             {'success': 'Вы отписались от пользователя'},
             status=status.HTTP_204_NO_CONTENT
@@ -360,10 +382,13 @@ class TagViewSet(viewsets.ModelViewSet):
     http_method_names = ['get', ]
 
     def list(self, request, *args, **kwargs):
-        queryset = self.filter_queryset(self.get_queryset())
-        serializer = self.get_serializer(queryset, many=True)
+        return catalog_response(
+            request, tags_cache, 'list', self.get_list_data
+        )
 
-        return Response(serializer.data)
+    def get_list_data(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        return self.get_serializer(queryset, many=True).data
 
 
 class IngredientsViewSet(viewsets.ModelViewSet):
@@ -374,33 +399,216 @@ class IngredientsViewSet(viewsets.ModelViewSet):
     http_method_names = ['get', ]
 
     def list(self, request, *args, **kwargs):
-        queryset = self.filter_queryset(self.get_queryset())
-        serializer = self.get_serializer(queryset, many=True)
+        name = request.GET.get('name', '')
 
-        return Response(serializer.data)
+        return catalog_response(
+            request, ingredients_cache, f'list:{name}',
+            lambda: self.get_list_data(name)
+        )
+
+    def get_list_data(self, name):
+        if not name:
+            queryset = self.filter_queryset(self.get_queryset())
+            return self.get_serializer(queryset, many=True).data
+
+        if settings.INGREDIENT_SEARCH_INDEX:
+            return ingredient_search_index.search(
+                name, MAX_INGREDIENT_SEARCH_RESULTS
+            )
+
+        queryset = self.filter_queryset(
+            self.get_queryset()
+        )[:MAX_INGREDIENT_SEARCH_RESULTS]
+
+        return self.get_serializer(queryset, many=True).data
 
 
 class RecipeViewSet(viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
-    filter_backends = (DjangoFilterBackend, filters.OrderingFilter)
+    filter_backends = (DjangoFilterBackend, RecipeOrderingFilter)
     filterset_class = RecipeFilter
-    pagination_class = RecipePagination
+    pagination_class = RecipeFeedPagination
     permission_classes = (IsAdminOrAuthorOrReadOnly,)
-    ordering = ('-pub_date',)
+    ordering = ('-pub_date', '-id')
+    ordering_fields = (
+        'id', 'name', 'cooking_time', 'pub_date',
+        'favorites_count', 'shopping_cart_count'
+    )
     http_method_names = ['get', 'post', 'patch', 'delete', 'head']
 
+    def get_queryset(self):
+        queryset = Recipe.objects.select_related('author').prefetch_related(
+            *recipe_prefetches()
+        ).defer('search_vector')
+
+        return annotate_recipe_flags(queryset, self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        if not is_cacheable(request):
+            return super().list(request, *args, **kwargs)
+
+        return cached_recipe_response(
+            request, recipes_cache, recipe_cache_key(request, 'list'),
+            lambda: super(RecipeViewSet, self).list(request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        if not is_cacheable(request):
+            return super().retrieve(request, *args, **kwargs)
+
+        return cached_recipe_response(
+            request, recipe_details_cache,
+            recipe_cache_key(request, 'retrieve', kwargs['pk']),
+            lambda: super(RecipeViewSet, self).retrieve(
+                request, *args, **kwargs
+            )
+        )
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['image_rendition'] = (
+            'thumbnail' if self.action == 'list' else 'detail'
+        )
+
+        return context
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
 
+class FollowedRecipesViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    '''Общая лента рецептов авторов из подписок пользователя'''
+    serializer_class = RecipeSerializer
+    permission_classes = (IsAuthenticated,)
+    pagination_class = RecipeCursorPagination
+
+    def get_queryset(self):
+        user = self.request.user
+
+        if (
+            settings.FEED_CACHE_SIZE
+            and 'cursor' not in self.request.query_params
+            and self.paginator.get_page_size(self.request)
+            < settings.FEED_CACHE_SIZE
+        ):
+            queryset = Recipe.objects.filter(id__in=cached_feed_ids(user))
+        else:
+            queryset = followed_recipes(user)
+
+        queryset = queryset.select_related('author').prefetch_related(
+            *recipe_prefetches()
+        ).defer('search_vector')
+
+        return annotate_recipe_flags(queryset, user)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['image_rendition'] = 'thumbnail'
+
+        return context
+
+
+class CookableRecipesViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    '''Рецепты, которые можно приготовить из заданных ингредиентов
+
+    Сортировка по доле имеющихся ингредиентов (coverage), рецепты
+    с долей меньше min_coverage не выводятся.
+    '''
+    serializer_class = CookableRecipeSerializer
+    permission_classes = (AllowAny,)
+    pagination_class = RecipePagination
+    count_params = ('ingredients', 'min_coverage')
+
+    def get_queryset(self):
+        params = CookableQuerySerializer(data=self.request.query_params)
+        params.is_valid(raise_exception=True)
+
+        queryset = cookable_recipes(
+            params.validated_data['ingredients'],
+            params.validated_data['min_coverage']
+        ).select_related('author').prefetch_related(
+            *recipe_prefetches()
+        ).defer('search_vector')
+
+        return annotate_recipe_flags(queryset, self.request.user)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['image_rendition'] = 'thumbnail'
+
+        return context
+
+
+class SimilarRecipesViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    '''Рецепты, которые чаще всего добавляют вместе с данным'''
+    serializer_class = RecipesInSubscriptionsSerializer
+    permission_classes = (AllowAny,)
+    pagination_class = None
+
+    def get_queryset(self):
+        return similar_recipes(self.kwargs['pk']).only(
+            'id', 'name', 'image', 'image_renditions', 'cooking_time'
+        )[:get_limit(self.request, RECOMMENDATION_NEIGHBORS)]
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+
+        if not response.data and not Recipe.objects.filter(
+            pk=kwargs['pk']
+        ).exists():
+            raise Http404
+
+        return response
+
+
+class RecommendedRecipesViewSet(mixins.ListModelMixin,
+                                viewsets.GenericViewSet):
+    '''Рекомендации по избранному и списку покупок пользователя
+
+    Без истории (и для анонимных пользователей) выводятся самые
+    популярные рецепты, кроме собственных и уже добавленных в избранное
+    или список покупок.
+    '''
+    serializer_class = RecipesInSubscriptionsSerializer
+    permission_classes = (AllowAny,)
+    pagination_class = None
+
+    def get_queryset(self):
+        user = self.request.user
+        limit = get_limit(self.request, RECOMMENDATION_NEIGHBORS)
+        recipes = Recipe.objects.only(
+            'id', 'name', 'image', 'image_renditions', 'cooking_time'
+        )
+        ids = (
+            recommended_recipe_ids(user, limit)
+            if user.is_authenticated else []
+        )
+
+        if not ids:
+            if user.is_authenticated:
+                recipes = recipes.exclude(author=user).exclude(
+                    favorite__user=user
+                ).exclude(shoppingcart__user=user)
+
+            return recipes.order_by('-favorites_count', '-id')[:limit]
+
+        recipes = recipes.in_bulk(ids)
+
+        return [
+            recipes[recipe_id] for recipe_id in ids if recipe_id in recipes
+        ]
+
+
 class FavoriteViewSet(
     mixins.CreateModelMixin, mixins.DestroyModelMixin, viewsets.GenericViewSet
 ):
     queryset = Favorite.objects.all()
 
     def create(self, request, *args, **kwargs):
-        serializer = FavoriteSerializer(data=request.data)
+        serializer = FavoriteSerializer(
+            data=request.data, context={'request': request}
+        )
         recipe_id = self.kwargs['pk']
 
         try:
@@ -416,30 +624,26 @@ class FavoriteViewSet(
 
         if serializer.is_valid():
 
-            if Favorite.objects.filter(
-                recipe__id=recipe_id, user=request.user
-            ).exists():
+            try:
+                with transaction.atomic():
+                    serializer.save(user=request.user, recipe=recipe)
+            except IntegrityError:
                 return Response(
                     {'error': 'Вы уже добавили этот рецепт в избранное'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            serializer.save(
-                user=request.user, recipe=Recipe.objects.get(id=recipe.id)
-            )
-
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @transaction.atomic
     def destroy(self, request, *args, **kwargs):
-        favorite_obj = Favorite.objects.filter(
+        deleted, _ = Favorite.objects.filter(
             recipe__id=self.kwargs['pk'], user=request.user
-        )
-
-        if favorite_obj.exists():
-            favorite_obj.delete()
+        ).delete()
 
+        if deleted:
             return Response(
                 {'success': 'Рецепт успешно удалён из избранных'},
                 status=status.HTTP_204_NO_CONTENT
@@ -457,7 +661,9 @@ class ShoppingCartViewSet(
     queryset = ShoppingCart.objects.all()
 
     def create(self, request, *args, **kwargs):
-        serializer = ShoppingCartSerializer(data=request.data)
+        serializer = ShoppingCartSerializer(
+            data=request.data, context={'request': request}
+        )
         recipe_id = self.kwargs['pk']
 
         try:
@@ -472,30 +678,26 @@ class ShoppingCartViewSet(
 
         if serializer.is_valid():
 
-            if ShoppingCart.objects.filter(
-                recipe__id=recipe_id, user=request.user
-            ).exists():
+            try:
+                with transaction.atomic():
+                    serializer.save(user=request.user, recipe=recipe)
+            except IntegrityError:
                 return Response(
                     {'error': 'Вы уже добавили этот рецепт в список покупок'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            serializer.save(
-                user=request.user, recipe=Recipe.objects.get(id=recipe.id)
-            )
-
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @transaction.atomic
     def destroy(self, request, *args, **kwargs):
-        shopping_cart_obj = ShoppingCart.objects.filter(
+        deleted, _ = ShoppingCart.objects.filter(
             recipe__id=self.kwargs['pk'], user=request.user
-        )
-
-        if shopping_cart_obj.exists():
-            shopping_cart_obj.delete()
+        ).delete()
 
+        if deleted:
             return Response(
                 {'success': 'Рецепт успешно удалён из списка покупок'},
                 status=status.HTTP_204_NO_CONTENT
@@ -508,45 +710,41 @@ class ShoppingCartViewSet(
 
 
 @api_view(['GET'])
+@permission_classes([IsAuthenticated])
 def download_shopping_cart(request):
-    recipes_in_shopping_cart = ShoppingCart.objects.filter(
-        user=request.user
-    )
-    ingredients_id = recipes_in_shopping_cart.values('recipe__ingredients')
-    recipes_id = recipes_in_shopping_cart.values('recipe')
-    ingredients = get_list_or_404(
-        RecipeIngridient,
-        recipe_id__in=recipes_id, ingredient_id__in=ingredients_id
-    )
-
-    ingredients_data = {}
+    '''Сводный список ингредиентов из рецептов в списке покупок'''
 
-    for ingredient in ingredients:
-        name = ingredient.ingredient.name
-        amount = ingredient.amount
-        measurement_unit = ingredient.ingredient.measurement_unit
-
-        if name in ingredients_data:
-            ingredients_data[name]['Количество'] += amount
-        else:
-            ingredients_data[name] = name
-            ingredients_data[name] = {
-                'Количество': amount,
-                'Единица измерения': measurement_unit
-            }
+    file_format = request.GET.get('file_format', 'txt')
 
-    json_data = json.dumps(ingredients_data, ensure_ascii=False)
-    file_path = 'ingredients.txt'
+    if file_format not in SHOPPING_CART_FORMATS:
+        return Response(
+            {
+                'error': 'Доступные форматы: {}'.format(
+                    ', '.join(SHOPPING_CART_FORMATS)
+                )
+            },
+            status=status.HTTP_400_BAD_REQUEST
+        )
 
-    with open(file_path, 'w', encoding='utf-8') as file:
-        file.write(json_data)
+    ingredients = cart_ingredients(request.user).iterator()
 
-    with open(file_path, 'rb') as file:
-        response = HttpResponse(
-            file.read(), content_type='text/plain; charset=utf-8'
-        )
-        response[
-            'Content-Disposition'
-        ] = 'attachment; filename=ingredients.txt'
+    try:
+        first_ingredient = next(ingredients)
+    except StopIteration:
+        raise Http404('Список покупок пуст')
+
+    content_type, render = SHOPPING_CART_FORMATS[file_format]
+    content = render(chain((first_ingredient,), ingredients))
+
+    # ASGI-обработчик Django 3.2 читает потоковый ответ прямо в
+    # event loop, поэтому строки собираются здесь, в потоке
+    # sync_to_async, где выполняется само представление
+    if settings.ASGI_MODE:
+        response = HttpResponse(''.join(content), content_type=content_type)
+    else:
+        response = StreamingHttpResponse(content, content_type=content_type)
+    response[
+        'Content-Disposition'
+    ] = f'attachment; filename=ingredients.{file_format}'
 
     return response
@@ -7,3 +7,15 @@ DEFAULT_PAGE_SIZE = 6
 MIN_VALUE_VALIDATOR = 1
 MAX_VALUE_VALIDATOR = 1440
 MAX_API_KEY_LENGHT = -40
+MAX_INGREDIENT_SEARCH_RESULTS = 50
+IMPORT_BATCH_SIZE = 1000
+IMAGE_DECODE_CHUNK_SIZE = 64 * 1024
+IMAGE_RENDITIONS = {
+    'thumbnail': (480, 480),
+    'detail': (1280, 1280),
+}
+MAX_PANTRY_INGREDIENTS = 100
+DEFAULT_MIN_COVERAGE = 0.5
+RECOMMENDATION_NEIGHBORS = 20
+RECOMMENDATION_MIN_SUPPORT = 2
+RECOMMENDATION_MAX_USER_ITEMS = 500
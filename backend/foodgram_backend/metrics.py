@@ -0,0 +1,184 @@
+import glob
+import json
+import os
+from bisect import bisect_left
+from collections import defaultdict
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+from django.http import HttpResponse
+
+DURATION_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (1024, 10240, 102400, 1048576)
+
+HISTOGRAMS = {
+    'duration_ms': DURATION_BUCKETS_MS,
+    'queries': QUERY_BUCKETS,
+    'db_ms': DURATION_BUCKETS_MS,
+    'serializer_ms': DURATION_BUCKETS_MS,
+    'size_bytes': SIZE_BUCKETS,
+}
+
+
+def empty_route():
+    return {
+        name: {'buckets': [0] * (len(bounds) + 1), 'sum': 0, 'count': 0}
+        for name, bounds in HISTOGRAMS.items()
+    }
+
+
+class RouteMetrics:
+    '''Гистограммы по маршрутам в памяти процесса
+
+    Если задан METRICS_DIR, каждый процесс периодически сохраняет свой
+    снимок в файл, а экспорт складывает снимки всех воркеров.
+    '''
+
+    def __init__(self):
+        self._lock = Lock()
+        self._routes = defaultdict(empty_route)
+        self._flushed_at = monotonic()
+
+    def observe(self, route, method, status, **values):
+        key = f'{method} {route} {status // 100}xx'
+
+        with self._lock:
+            histograms = self._routes[key]
+            for name, value in values.items():
+                histogram = histograms[name]
+                index = bisect_left(HISTOGRAMS[name], value)
+                histogram['buckets'][index] += 1
+                histogram['sum'] += value
+                histogram['count'] += 1
+
+        self.maybe_flush()
+
+    def snapshot(self):
+        with self._lock:
+            return json.loads(json.dumps(self._routes))
+
+    def maybe_flush(self):
+        if not settings.METRICS_DIR:
+            return
+
+        now = monotonic()
+        if now - self._flushed_at < settings.METRICS_FLUSH_INTERVAL:
+            return
+
+        self._flushed_at = now
+        self.flush()
+
+    def flush(self):
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        path = os.path.join(
+            settings.METRICS_DIR, f'metrics-{os.getpid()}.json'
+        )
+        temporary = f'{path}.tmp'
+
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump(self.snapshot(), file)
+        os.replace(temporary, path)
+
+
+route_metrics = RouteMetrics()
+
+
+def merge(target, source):
+    for key, histograms in source.items():
+        merged = target.setdefault(key, empty_route())
+        for name, histogram in histograms.items():
+            merged[name]['sum'] += histogram['sum']
+            merged[name]['count'] += histogram['count']
+            merged[name]['buckets'] = [
+                left + right for left, right in zip(
+                    merged[name]['buckets'], histogram['buckets']
+                )
+            ]
+
+    return target
+
+
+def collect():
+    '''Метрики всех процессов из METRICS_DIR или только текущего'''
+    if not settings.METRICS_DIR:
+        return route_metrics.snapshot()
+
+    route_metrics.flush()
+    routes = {}
+    pattern = os.path.join(settings.METRICS_DIR, 'metrics-*.json')
+
+    for path in glob.glob(pattern):
+        try:
+            with open(path, encoding='utf-8') as file:
+                merge(routes, json.load(file))
+        except (OSError, ValueError):
+            continue
+
+    return routes
+
+
+def estimate_percentile(histogram, bounds, percent):
+    '''Верхняя граница корзины, в которую попадает перцентиль'''
+    if not histogram['count']:
+        return 0
+
+    rank = histogram['count'] * percent / 100
+    seen = 0
+    for index, count in enumerate(histogram['buckets']):
+        seen += count
+        if seen >= rank:
+            return bounds[index] if index < len(bounds) else float('inf')
+
+    return float('inf')
+
+
+PROMETHEUS_METRICS = {
+    'duration_ms': ('foodgram_request_duration_seconds', 0.001),
+    'queries': ('foodgram_request_queries', 1),
+    'db_ms': ('foodgram_request_db_seconds', 0.001),
+    'serializer_ms': ('foodgram_request_serializer_seconds', 0.001),
+    'size_bytes': ('foodgram_response_size_bytes', 1),
+}
+
+
+def prometheus_text(routes):
+    lines = []
+
+    for name, (metric, scale) in PROMETHEUS_METRICS.items():
+        lines.append(f'# TYPE {metric} histogram')
+        bounds = HISTOGRAMS[name]
+
+        for key in sorted(routes):
+            method, route, status = key.split(' ', 2)
+            route = route.replace('\\', '\\\\').replace('"', '\\"')
+            labels = (
+                f'method="{method}",route="{route}",status="{status}"'
+            )
+            histogram = routes[key][name]
+            cumulative = 0
+
+            for bound, count in zip(bounds, histogram['buckets']):
+                cumulative += count
+                lines.append(
+                    f'{metric}_bucket{{{labels},le="{bound * scale:g}"}} '
+                    f'{cumulative}'
+                )
+            lines.append(
+                f'{metric}_bucket{{{labels},le="+Inf"}} {histogram["count"]}'
+            )
+            lines.append(
+                f'{metric}_sum{{{labels}}} {histogram["sum"] * scale:g}'
+            )
+            lines.append(f'{metric}_count{{{labels}}} {histogram["count"]}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    '''Гистограммы в текстовом формате Prometheus'''
+    return HttpResponse(
+        prometheus_text(collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from .metrics import route_metrics
+
+logger = logging.getLogger(__name__)
+
+SLOWEST_QUERIES = 3
+SQL_PREVIEW_LENGTH = 300
+
+current_request = ContextVar('current_request', default=None)
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = []
+        self.db_ms = 0
+        self.serializer_ms = 0
+        self.serializing = False
+
+    def __call__(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (perf_counter() - started) * 1000
+            self.db_ms += duration
+            self.queries.append((duration, sql))
+
+
+def record_query(execute, sql, params, many, context):
+    stats = current_request.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+
+    return stats(execute, sql, params, many, context)
+
+
+def install_query_recorder(connection, **kwargs):
+    '''Обёртка ставится на каждое соединение при подключении
+
+    Под ASGI синхронные представления работают в потоках sync_to_async
+    со своими соединениями, а запрос, к которому относится SQL,
+    определяется через contextvar, который asgiref переносит в поток.
+    '''
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class TimedRepresentationMixin:
+    '''Время to_representation внешнего сериализатора без учёта базы
+
+    Вложенные сериализаторы выполняются внутри внешнего и отдельно не
+    считаются.
+    '''
+
+    def to_representation(self, instance):
+        stats = current_request.get()
+        if stats is None or stats.serializing:
+            return super().to_representation(instance)
+
+        stats.serializing = True
+        db_ms = stats.db_ms
+        started = perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            stats.serializer_ms += (
+                (perf_counter() - started) * 1000 - (stats.db_ms - db_ms)
+            )
+            stats.serializing = False
+
+
+class RequestMetricsMiddleware:
+    '''Число запросов, время базы и сериализации, размер ответа
+
+    Итог складывается в гистограммы по маршрутам, медленные запросы
+    пишутся в лог вместе с самым медленным SQL. Заголовок Server-Timing
+    отдаётся клиенту только при SERVER_TIMING. Работает и в sync-, и
+    в async-цепочке, чтобы под ASGI не переводить async-представления
+    в поток.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        connection_created.connect(
+            install_query_recorder, dispatch_uid='request_metrics'
+        )
+        for connection in connections.all():
+            install_query_recorder(connection)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        started = perf_counter()
+
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+
+        return self.finish(request, response, stats, started)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = current_request.set(stats)
+        started = perf_counter()
+
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request.reset(token)
+
+        return self.finish(request, response, stats, started)
+
+    def finish(self, request, response, stats, started):
+        duration_ms = (perf_counter() - started) * 1000
+        match = request.resolver_match
+        route = match.route if match else 'unmatched'
+        values = {
+            'duration_ms': duration_ms,
+            'queries': len(stats.queries),
+            'db_ms': stats.db_ms,
+            'serializer_ms': stats.serializer_ms,
+        }
+
+        # Размер потокового ответа известен только после отдачи
+        if not response.streaming:
+            values['size_bytes'] = len(response.content)
+
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = ', '.join((
+                f'db;dur={stats.db_ms:.1f};'
+                f'desc="{len(stats.queries)} queries"',
+                f'ser;dur={stats.serializer_ms:.1f}',
+                f'total;dur={duration_ms:.1f}',
+            ))
+
+        route_metrics.observe(
+            route, request.method, response.status_code, **values
+        )
+
+        if duration_ms >= settings.SLOW_REQUEST_MS:
+            self.log_slow_request(request, response, stats, duration_ms)
+
+        return response
+
+    def log_slow_request(self, request, response, stats, duration_ms):
+        slowest = sorted(stats.queries, key=lambda query: -query[0])
+        logger.warning(
+            'Медленный запрос %s %s: %s, %.1f мс, SQL %d шт. за %.1f мс, '
+            'сериализация %.1f мс%s',
+            request.method, request.get_full_path(), response.status_code,
+            duration_ms, len(stats.queries), stats.db_ms,
+            stats.serializer_ms,
+            ''.join(
+                f'\n  {duration:.1f} мс: {sql[:SQL_PREVIEW_LENGTH]}'
+                for duration, sql in slowest[:SLOWEST_QUERIES]
+            )
+        )
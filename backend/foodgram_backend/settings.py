@@ -35,6 +35,13 @@ INSTALLED_APPS = [
     'rest_framework_simplejwt.token_blacklist',
 ]
 
+REQUEST_METRICS = os.getenv('REQUEST_METRICS', 'True') == 'True'
+SLOW_REQUEST_MS = int(os.getenv('SLOW_REQUEST_MS', 500))
+SERVER_TIMING = os.getenv('SERVER_TIMING', str(DEBUG)) == 'True'
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = int(os.getenv('METRICS_FLUSH_INTERVAL', 10))
+METRICS_ENDPOINT = os.getenv('METRICS_ENDPOINT', 'False') == 'True'
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -45,6 +52,9 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+if REQUEST_METRICS:
+    MIDDLEWARE.insert(0, 'foodgram_backend.middleware.RequestMetricsMiddleware')
+
 ROOT_URLCONF = 'foodgram_backend.urls'
 
 TEMPLATES = [
@@ -65,6 +75,8 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'foodgram_backend.wsgi.application'
 
+ASGI_MODE = os.getenv('SERVER_MODE', 'wsgi') == 'asgi'
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -72,10 +84,52 @@ DATABASES = {
         'USER': os.getenv('POSTGRES_USER', 'django'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
         'HOST': os.getenv('DB_HOST', ''),
-        'PORT': os.getenv('DB_PORT', 5432)
+        'PORT': os.getenv('DB_PORT', 5432),
+        'CONN_MAX_AGE': int(
+            os.getenv('DB_CONN_MAX_AGE', 0 if ASGI_MODE else 60)
+        ),
+        'DISABLE_SERVER_SIDE_CURSORS': os.getenv('DB_POOLER') == 'pgbouncer',
     }
 }
 
+DB_CONN_HEALTH_CHECKS = os.getenv('DB_CONN_HEALTH_CHECKS', 'True') == 'True'
+DB_CONN_HEALTH_CHECK_IDLE = int(os.getenv('DB_CONN_HEALTH_CHECK_IDLE', 10))
+
+CACHE_BACKEND = os.getenv(
+    'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+)
+CACHE_LOCATION = os.getenv('CACHE_LOCATION', '')
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': CACHE_LOCATION,
+    },
+    # Версии кэшей должны быть общими для всех процессов: воркеров
+    # gunicorn и management-команд. Если основной кэш общий (Redis,
+    # Memcached), версии хранятся в нём же, иначе - в файлах, которые
+    # видны только процессам на одном хосте.
+    'versions': {
+        'BACKEND': os.getenv(
+            'VERSION_CACHE_BACKEND',
+            CACHE_BACKEND if CACHE_BACKEND not in PROCESS_LOCAL_CACHES
+            else 'django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.getenv(
+            'VERSION_CACHE_LOCATION',
+            CACHE_LOCATION if CACHE_BACKEND not in PROCESS_LOCAL_CACHES
+            else '/tmp/foodgram-cache-versions'
+        ),
+        'KEY_PREFIX': 'versions',
+    },
+}
+
+CACHE_VERSION_ALIAS = os.getenv('CACHE_VERSION_ALIAS', 'versions')
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -125,3 +179,35 @@ SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('API-Key',),
     'BLACKLIST_AFTER_ROTATION': True,
 }
+
+INGREDIENT_SEARCH_INDEX = os.getenv('INGREDIENT_SEARCH_INDEX', 'False') == 'True'
+INGREDIENT_SEARCH_INDEX_TTL = int(os.getenv('INGREDIENT_SEARCH_INDEX_TTL', 300))
+
+CATALOG_CACHE_ALIAS = os.getenv('CATALOG_CACHE_ALIAS') or None
+CATALOG_CACHE_MAXSIZE = int(os.getenv('CATALOG_CACHE_MAXSIZE', 256))
+CATALOG_CACHE_TTL = int(os.getenv('CATALOG_CACHE_TTL', 300))
+
+RECIPE_CACHE_MAXSIZE = int(os.getenv('RECIPE_CACHE_MAXSIZE', 512))
+RECIPE_CACHE_TTL = int(os.getenv('RECIPE_CACHE_TTL', 60))
+
+RECIPE_SEARCH_CONFIG = os.getenv('RECIPE_SEARCH_CONFIG', 'russian')
+RECIPE_SEARCH_INDEX_TTL = int(os.getenv('RECIPE_SEARCH_INDEX_TTL', 300))
+
+FEED_CACHE_ALIAS = os.getenv('FEED_CACHE_ALIAS', 'default')
+FEED_CACHE_SIZE = int(os.getenv('FEED_CACHE_SIZE', 0))
+FEED_CACHE_TTL = int(os.getenv('FEED_CACHE_TTL', 600))
+
+AUTH_TOKEN_CACHE_ALIAS = os.getenv('AUTH_TOKEN_CACHE_ALIAS', 'default')
+AUTH_TOKEN_CACHE_TTL = int(os.getenv('AUTH_TOKEN_CACHE_TTL', 0))
+
+COUNT_CACHE_ALIAS = os.getenv('COUNT_CACHE_ALIAS', 'default')
+COUNT_CACHE_TTL = int(os.getenv('COUNT_CACHE_TTL', 30))
+APPROXIMATE_COUNT_THRESHOLD = int(
+    os.getenv('APPROXIMATE_COUNT_THRESHOLD', 100000)
+)
+
+MAX_IMAGE_UPLOAD_SIZE = int(os.getenv('MAX_IMAGE_UPLOAD_SIZE', 5242880))
+DATA_UPLOAD_MAX_MEMORY_SIZE = MAX_IMAGE_UPLOAD_SIZE * 4 // 3 + 1048576
+IMAGE_RENDITION_FORMAT = os.getenv('IMAGE_RENDITION_FORMAT', 'WEBP')
+IMAGE_RENDITION_QUALITY = int(os.getenv('IMAGE_RENDITION_QUALITY', 80))
+IMAGE_RENDITION_WORKERS = int(os.getenv('IMAGE_RENDITION_WORKERS', 2))
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Recipe, Favorite, Ingridient, Tag
+from .models import Recipe, Ingridient, Tag
 
 
 @admin.register(Tag)
@@ -31,7 +31,7 @@ class RecipeAdmin(admin.ModelAdmin):
     readonly_fields = ('in_favorite_count',)
 
     def in_favorite_count(self, obj):
-        return Favorite.objects.filter(recipe=obj).count()
+        return obj.favorites_count
 
 
 admin.site.empty_value_display = 'Не задано'
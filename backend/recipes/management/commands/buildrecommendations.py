@@ -0,0 +1,63 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from api.recommendations import (build_neighbors, build_recommendations,
+                                 save_neighbors, save_recommendations,
+                                 user_interactions)
+from foodgram_backend.constants import (RECOMMENDATION_MAX_USER_ITEMS,
+                                        RECOMMENDATION_MIN_SUPPORT,
+                                        RECOMMENDATION_NEIGHBORS)
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчёт похожих рецептов по совместному добавлению в избранное '
+        'и списки покупок и рекомендаций пользователям. Пары считаются '
+        'заново при каждом запуске, в базе перезаписываются только '
+        'изменившиеся списки.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--neighbors', type=int, default=RECOMMENDATION_NEIGHBORS,
+            help='Число соседей на рецепт'
+        )
+        parser.add_argument(
+            '--min-support', type=int, default=RECOMMENDATION_MIN_SUPPORT,
+            help='Минимальное число пользователей у пары рецептов'
+        )
+        parser.add_argument(
+            '--max-user-items', type=int,
+            default=RECOMMENDATION_MAX_USER_ITEMS,
+            help='Сколько рецептов пользователя учитывать: сначала '
+                 'избранное, затем список покупок, в каждом последние '
+                 'добавленные'
+        )
+
+    def handle(self, *args, **options):
+        started = perf_counter()
+        interactions = user_interactions()
+        neighbors = build_neighbors(
+            interactions,
+            neighbors=options['neighbors'],
+            min_support=options['min_support'],
+            max_user_items=options['max_user_items']
+        )
+        recommendations = build_recommendations(
+            interactions, neighbors,
+            limit=options['neighbors'],
+            max_user_items=options['max_user_items']
+        )
+        changed = save_neighbors(neighbors)
+        changed_users = save_recommendations(recommendations)
+
+        self.stdout.write(
+            f'Пользователей: {len(interactions)}, '
+            f'рецептов с соседями: {len(neighbors)}, '
+            f'обновлено списков соседей: {changed}, '
+            f'рекомендаций: {changed_users}'
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {perf_counter() - started:.1f} с'
+        ))
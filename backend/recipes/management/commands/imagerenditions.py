@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from api.images import make_renditions
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        'Подготовка уменьшенных копий картинок рецептов, для которых '
+        'копии ещё не отмечены готовыми'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Пересоздать копии всех картинок'
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(image_renditions=False)
+        done = 0
+
+        for name in recipes.values_list('image', flat=True).iterator():
+            try:
+                make_renditions(name)
+            except OSError as error:
+                self.stderr.write(f'{name}: {error}')
+            else:
+                done += 1
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Обработано картинок: {done}')
+        )
@@ -1,23 +1,57 @@
 import csv
+import json
 import os
+from itertools import islice
+from time import monotonic
 
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.catalog_cache import ingredients_cache
+from foodgram_backend.constants import (IMPORT_BATCH_SIZE,
+                                        MAX_TAGS_AND_INGS_FIELDS_LENGHT)
 from recipes.models import Ingridient
 
+CSV_HEADER = ['name', 'measurement_unit']
+
 
 class Command(BaseCommand):
+    help = 'Импорт ингредиентов из CSV или JSON файла'
+
     def add_arguments(self, parser):
         parser.add_argument('csv_file', type=str)
+        parser.add_argument(
+            '--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+            help='Количество строк в одном INSERT'
+        )
+
+    def read_csv(self, file):
+        reader = csv.reader(file)
+        first_row = next(reader, None)
+
+        if first_row is not None and first_row != CSV_HEADER:
+            yield first_row
+
+        yield from reader
+
+    def read_json(self, file):
+        for item in json.load(file):
+            yield [item.get('name'), item.get('measurement_unit')]
 
     def create_ingredients(self, row):
-        return Ingridient(name=row[0], measurement_unit=row[1])
+        name, measurement_unit = row
+
+        for value in row:
+            if not value or len(value) > MAX_TAGS_AND_INGS_FIELDS_LENGHT:
+                raise ValueError(f'Некорректное значение {value!r}')
+
+        return Ingridient(name=name, measurement_unit=measurement_unit)
 
-    def import_data(self, reader, object_creator):
-        for row in reader:
+    def build_objects(self, rows, object_creator):
+        for row in rows:
 
             try:
-                obj = object_creator(row)
-                obj.save()
+                yield object_creator(row)
             except Exception as e:
                 self.stdout.write(
                     self.style.ERROR('Невозможно импортировать. ' + repr(e))
@@ -25,29 +59,62 @@ class Command(BaseCommand):
 
                 continue
 
+    def import_data(self, rows, object_creator, batch_size):
+        objects = self.build_objects(rows, object_creator)
+        total = 0
+        started = monotonic()
+
+        with transaction.atomic():
+
+            while True:
+                batch = list(islice(objects, batch_size))
+                if not batch:
+                    break
+
+                Ingridient.objects.bulk_create(batch, ignore_conflicts=True)
+                total += len(batch)
+
+                if self.verbosity > 1:
+                    self.stdout.write(f'Обработано строк: {total}')
+
+        elapsed = monotonic() - started
+
+        return total, elapsed
+
     def handle(self, *args, **options):
-        filename_to_creator_function = {
-            'ingredients.csv': self.create_ingredients,
+        extension_to_reader = {
+            '.csv': self.read_csv,
+            '.json': self.read_json,
         }
 
         csv_file = options['csv_file']
+        batch_size = options['batch_size']
+        self.verbosity = options['verbosity']
 
-        try:
+        if batch_size < 1:
+            raise CommandError('Размер пакета должен быть больше нуля')
 
-            with open(csv_file, 'r', encoding='utf-8') as file:
-                reader = csv.reader(file)
-                next(reader)
+        extension = os.path.splitext(csv_file)[1].lower()
 
-                try:
-                    filename = os.path.basename(csv_file)
-                    object_creator = filename_to_creator_function[filename]
-                except KeyError:
-                    raise CommandError(f'Не найден файл "{filename}"')
+        try:
+            reader = extension_to_reader[extension]
+        except KeyError:
+            raise CommandError(f'Неподдерживаемый формат "{extension}"')
+
+        try:
 
-                self.import_data(reader, object_creator)
+            with open(csv_file, 'r', encoding='utf-8') as file:
+                total, elapsed = self.import_data(
+                    reader(file), self.create_ingredients, batch_size
+                )
 
         except Exception as e:
 
-            raise CommandError(f'Невозможно открыть файл: {str(e)}')
+            raise CommandError(f'Невозможно импортировать файл: {str(e)}')
 
-        self.stdout.write(self.style.SUCCESS('Дата успешно импортирована'))
+        ingredients_cache.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f'Дата успешно импортирована, обработано {total} строк '
+            f'за {elapsed:.2f} с '
+            f'({total / max(elapsed, 1e-6):.0f} строк/с)'
+        ))
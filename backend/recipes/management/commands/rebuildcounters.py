@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.counters import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчёт счётчиков избранного, покупок, ингредиентов, рецептов '
+        'и подписчиков'
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            updated = rebuild_counters()
+
+        for counter, rows in updated.items():
+            self.stdout.write(f'{counter}: обновлено строк {rows}')
+
+        self.stdout.write(self.style.SUCCESS('Счётчики пересчитаны'))
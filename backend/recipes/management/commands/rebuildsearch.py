@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api.recipe_search import refresh_search_vectors
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Пересчёт поисковых векторов рецептов (только PostgreSQL)'
+
+    def handle(self, *args, **options):
+        updated = refresh_search_vectors(Recipe.objects.all())
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Поисковые векторы пересчитаны, обновлено строк {updated}'
+        ))
@@ -0,0 +1,37 @@
+# Generated by Django 3.2.3 on 2026-10-18 19:42
+
+from django.db import migrations
+
+
+def create_trigram_index(apps, schema_editor):
+    '''icontains и istartswith сравнивают UPPER("name"::text)
+
+    Поэтому индекс строится по тому же выражению: по самому name такие
+    запросы его не использовали бы.
+    '''
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS ingridient_name_upper_trgm_idx '
+        'ON recipes_ingridient USING gin (UPPER(name::text) gin_trgm_ops)'
+    )
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    schema_editor.execute('DROP INDEX IF EXISTS ingridient_name_upper_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
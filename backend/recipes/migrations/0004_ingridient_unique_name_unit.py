@@ -0,0 +1,72 @@
+# Generated by Django 3.2.3 on 2026-10-18 19:44
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+# Предел PositiveSmallIntegerField
+MAX_AMOUNT = 32767
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    '''Повторный importcsv дублировал справочник: оставляем первую запись
+
+    Если в рецепте есть несколько дубликатов одного ингредиента, строки
+    объединяются в одну с суммой количеств.
+    '''
+    Ingridient = apps.get_model('recipes', 'Ingridient')
+    RecipeIngridient = apps.get_model('recipes', 'RecipeIngridient')
+
+    duplicates = Ingridient.objects.values(
+        'name', 'measurement_unit'
+    ).annotate(
+        first_id=Min('id'), total=Count('id')
+    ).filter(total__gt=1)
+
+    for duplicate in duplicates:
+        first_id = duplicate['first_id']
+        duplicate_ids = list(Ingridient.objects.filter(
+            name=duplicate['name'],
+            measurement_unit=duplicate['measurement_unit']
+        ).exclude(id=first_id).values_list('id', flat=True))
+
+        merged = {}
+        merged_away = []
+
+        for row in RecipeIngridient.objects.filter(
+            ingredient_id__in=[first_id, *duplicate_ids]
+        ).order_by('id'):
+            kept = merged.setdefault(row.recipe_id, row)
+            if kept is not row:
+                kept.amount = min(kept.amount + row.amount, MAX_AMOUNT)
+                merged_away.append(row.id)
+            kept.ingredient_id = first_id
+
+        RecipeIngridient.objects.filter(id__in=merged_away).delete()
+        RecipeIngridient.objects.bulk_update(
+            merged.values(), ['ingredient', 'amount']
+        )
+        Ingridient.objects.filter(id__in=duplicate_ids).delete()
+
+    # Отложенные проверки внешних ключей должны сработать до ALTER TABLE,
+    # иначе PostgreSQL откажет с "pending trigger events"
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        schema_editor.execute('SET CONSTRAINTS ALL DEFERRED')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_ingridient_name_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='ingridient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingridient_name_unit'),
+        ),
+    ]
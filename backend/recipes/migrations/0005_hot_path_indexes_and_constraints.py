@@ -0,0 +1,62 @@
+# Generated by Django 3.2.3 on 2026-10-18 19:50
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def delete_duplicates(model, fields):
+    duplicates = model.objects.values(*fields).annotate(
+        first_id=Min('id'), total=Count('id')
+    ).filter(total__gt=1)
+
+    for duplicate in duplicates:
+        model.objects.filter(
+            **{field: duplicate[field] for field in fields}
+        ).exclude(id=duplicate['first_id']).delete()
+
+
+def delete_duplicate_rows(apps, schema_editor):
+    '''Без ограничений повторные запросы могли создать дубликаты'''
+    delete_duplicates(apps.get_model('recipes', 'Favorite'), ['user', 'recipe'])
+    delete_duplicates(
+        apps.get_model('recipes', 'ShoppingCart'), ['user', 'recipe']
+    )
+    delete_duplicates(
+        apps.get_model('recipes', 'RecipeIngridient'), ['recipe', 'ingredient']
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_ingridient_unique_name_unit'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_rows, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-pub_date'], name='recipe_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-pub_date'], name='recipe_author_pub_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='favorite',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_favorite_user_recipe'),
+        ),
+        migrations.AddConstraint(
+            model_name='recipeingridient',
+            constraint=models.UniqueConstraint(fields=('recipe', 'ingredient'), name='unique_recipe_ingridient'),
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcart',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_shoppingcart_user_recipe'),
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS recipe_tags_tag_recipe_idx '
+            'ON recipes_recipe_tags (tag_id, recipe_id)',
+            'DROP INDEX IF EXISTS recipe_tags_tag_recipe_idx',
+        ),
+    ]
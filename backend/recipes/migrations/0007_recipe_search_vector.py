@@ -0,0 +1,49 @@
+# Generated by Django 3.2.3 on 2026-10-18 20:13
+
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+
+def fill_search_vectors(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    schema_editor.execute(
+        'UPDATE recipes_recipe SET search_vector = '
+        "setweight(to_tsvector(%(config)s, coalesce(name, '')), 'A') || "
+        'setweight(to_tsvector(%(config)s, coalesce(('
+        "SELECT string_agg(i.name, ' ') FROM recipes_recipeingridient ri "
+        'JOIN recipes_ingridient i ON i.id = ri.ingredient_id '
+        'WHERE ri.recipe_id = recipes_recipe.id'
+        "), '')), 'B') || "
+        "setweight(to_tsvector(%(config)s, coalesce(description, '')), 'C')",
+        {'config': settings.RECIPE_SEARCH_CONFIG}
+    )
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS recipe_search_vector_idx '
+        'ON recipes_recipe USING gin (search_vector)'
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    schema_editor.execute('DROP INDEX IF EXISTS recipe_search_vector_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(fill_search_vectors, drop_search_index),
+    ]
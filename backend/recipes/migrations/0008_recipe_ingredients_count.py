@@ -0,0 +1,40 @@
+# Generated by Django 3.2.3 on 2026-10-18 20:15
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_ingredients_count(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeIngridient = apps.get_model('recipes', 'RecipeIngridient')
+
+    Recipe.objects.update(ingredients_count=Coalesce(
+        Subquery(
+            RecipeIngridient.objects.filter(recipe=OuterRef('pk')).order_by()
+            .values('recipe').annotate(total=Count('pk')).values('total')
+        ),
+        0
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredients_count',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='Число ингредиентов'),
+        ),
+        migrations.AddIndex(
+            model_name='recipeingridient',
+            index=models.Index(fields=['ingredient', 'recipe'], name='recipeingridient_ing_rec_idx'),
+        ),
+        migrations.RunPython(
+            fill_ingredients_count, migrations.RunPython.noop
+        ),
+    ]
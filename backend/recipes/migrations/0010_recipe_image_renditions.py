@@ -0,0 +1,18 @@
+# Generated by Django 3.2.3 on 2026-10-18 20:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_neighbors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_renditions',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Уменьшенные копии картинки готовы'),
+        ),
+    ]
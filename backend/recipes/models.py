@@ -1,3 +1,4 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
 from colorfield.fields import ColorField
@@ -7,7 +8,7 @@ from foodgram_backend.constants import (
     MIN_VALUE_VALIDATOR, MAX_VALUE_VALIDATOR,
     MAX_TAGS_AND_INGS_FIELDS_LENGHT
 )
-from users.models import CustomUser
+from users.models import CounterFieldsMixin, CustomUser
 
 
 class Tag(models.Model):
@@ -45,9 +46,15 @@ class Ingridient(models.Model):
     class Meta:
         verbose_name = 'Ингридиент'
         verbose_name_plural = 'Ингридиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingridient_name_unit'
+            )
+        ]
 
 
-class Recipe(models.Model):
+class Recipe(CounterFieldsMixin, models.Model):
     author = models.ForeignKey(
         CustomUser, on_delete=models.CASCADE,
         verbose_name='Автор публикации',
@@ -60,6 +67,10 @@ class Recipe(models.Model):
         upload_to='recipes/images/',
         verbose_name='Картинка'
     )
+    image_renditions = models.BooleanField(
+        default=False, editable=False,
+        verbose_name='Уменьшенные копии картинки готовы'
+    )
     description = models.TextField(verbose_name='Текстовое описание')
     ingredients = models.ManyToManyField(
         Ingridient, verbose_name='Ингридиенты', through='RecipeIngridient'
@@ -78,6 +89,26 @@ class Recipe(models.Model):
         auto_now_add=True,
         verbose_name='Дата публикации'
     )
+    favorites_count = models.PositiveIntegerField(
+        default=0, editable=False,
+        verbose_name='В избранном'
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        default=0, editable=False,
+        verbose_name='В списках покупок'
+    )
+    ingredients_count = models.PositiveSmallIntegerField(
+        default=0, editable=False,
+        verbose_name='Число ингредиентов'
+    )
+    search_vector = SearchVectorField(
+        null=True, editable=False,
+        verbose_name='Поисковый вектор'
+    )
+
+    counter_fields = (
+        'favorites_count', 'shopping_cart_count', 'ingredients_count'
+    )
 
     def __str__(self):
         return self.name
@@ -85,6 +116,17 @@ class Recipe(models.Model):
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(fields=['-pub_date'], name='recipe_pub_date_idx'),
+            models.Index(
+                fields=['author', '-pub_date'],
+                name='recipe_author_pub_date_idx'
+            ),
+            models.Index(
+                fields=['-favorites_count', '-id'],
+                name='recipe_favorites_count_idx'
+            ),
+        ]
 
 
 class RecipeIngridient(models.Model):
@@ -113,6 +155,18 @@ class RecipeIngridient(models.Model):
     class Meta:
         verbose_name = 'Ингриддиент по рецепту'
         verbose_name_plural = 'Ингриддиенты по рецептам'
+        indexes = [
+            models.Index(
+                fields=['ingredient', 'recipe'],
+                name='recipeingridient_ing_rec_idx'
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'ingredient'],
+                name='unique_recipe_ingridient'
+            )
+        ]
 
 
 class FavoriteAndShoppingCartBase(models.Model):
@@ -129,14 +183,14 @@ class FavoriteAndShoppingCartBase(models.Model):
         abstract = True
         constraints = [
             models.UniqueConstraint(
-                fields=['recipe', 'user'], name='unique_fields'
+                fields=['user', 'recipe'], name='unique_%(class)s_user_recipe'
             )
         ]
 
 
 class Favorite(FavoriteAndShoppingCartBase):
 
-    class Meta:
+    class Meta(FavoriteAndShoppingCartBase.Meta):
         verbose_name = 'Избранный рецепт'
         verbose_name_plural = 'Избранные рецепты'
 
@@ -146,9 +200,71 @@ class Favorite(FavoriteAndShoppingCartBase):
 
 class ShoppingCart(FavoriteAndShoppingCartBase):
 
-    class Meta:
+    class Meta(FavoriteAndShoppingCartBase.Meta):
         verbose_name = 'Список покупок'
         verbose_name_plural = 'Списки покупок'
 
     def __str__(self):
         return f'{self.owner} - {self.recipe.name}'
+
+
+class RecipeNeighbor(models.Model):
+    '''Похожий рецепт по совместному добавлению в избранное и покупки'''
+    recipe = models.ForeignKey(
+        Recipe, on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+        related_name='neighbors'
+    )
+    neighbor = models.ForeignKey(
+        Recipe, on_delete=models.CASCADE,
+        verbose_name='Похожий рецепт',
+        related_name='neighbor_of'
+    )
+    score = models.FloatField(verbose_name='Сходство')
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        indexes = [
+            models.Index(
+                fields=['recipe', '-score'],
+                name='recipe_neighbor_score_idx'
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'neighbor'],
+                name='unique_recipe_neighbor'
+            )
+        ]
+
+
+class RecipeRecommendation(models.Model):
+    '''Рекомендованный пользователю рецепт, считается офлайн'''
+    user = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        related_name='recommendations'
+    )
+    recipe = models.ForeignKey(
+        Recipe, on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+        related_name='recommended_to'
+    )
+    score = models.FloatField(verbose_name='Сумма сходства')
+
+    class Meta:
+        verbose_name = 'Рекомендация'
+        verbose_name_plural = 'Рекомендации'
+        indexes = [
+            models.Index(
+                fields=['user', '-score'],
+                name='recipe_recommendation_user_idx'
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_recipe_recommendation'
+            )
+        ]
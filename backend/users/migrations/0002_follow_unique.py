@@ -0,0 +1,34 @@
+# Generated by Django 3.2.3 on 2026-10-18 19:50
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def delete_duplicate_follows(apps, schema_editor):
+    Follow = apps.get_model('users', 'Follow')
+
+    duplicates = Follow.objects.values('user', 'following').annotate(
+        first_id=Min('id'), total=Count('id')
+    ).filter(total__gt=1)
+
+    for duplicate in duplicates:
+        Follow.objects.filter(
+            user=duplicate['user'], following=duplicate['following']
+        ).exclude(id=duplicate['first_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            delete_duplicate_follows, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.UniqueConstraint(fields=('user', 'following'), name='unique_follow'),
+        ),
+    ]
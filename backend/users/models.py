@@ -7,7 +7,29 @@ from foodgram_backend.constants import (MAX_EMAIL_LENGHT,
 from api.validators import check_name
 
 
-class CustomUser(AbstractUser):
+class CounterFieldsMixin:
+    '''save() существующей строки не перезаписывает счётчики
+
+    Счётчики меняются атомарно через F(), в загруженном объекте их
+    значения могли устареть. Сохраняются они, только если явно названы
+    в update_fields.
+    '''
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+                and field.attname not in deferred
+            ]
+
+        super().save(*args, **kwargs)
+
+
+class CustomUser(CounterFieldsMixin, AbstractUser):
     username = models.CharField(
         max_length=MAX_USER_FIELDS_LENGHT,
         unique=True, verbose_name='Логин',
@@ -26,6 +48,14 @@ class CustomUser(AbstractUser):
     last_name = models.CharField(
         max_length=MAX_USER_FIELDS_LENGHT, verbose_name='Фамилия', blank=True
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='Рецептов'
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='Подписчиков'
+    )
+
+    counter_fields = ('recipes_count', 'followers_count')
 
     def __str__(self):
         return self.username
@@ -48,3 +78,8 @@ class Follow(models.Model):
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'following'], name='unique_follow'
+            )
+        ]